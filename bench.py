@@ -0,0 +1,291 @@
+"""end-to-end benchmark of the solver over a corpus of boards
+
+each board in the corpus is solved from scratch in its own process; the
+report gives, per board, the solve time (fastest of the repeats) broken down
+by phase (see SolveStats), the peak memory of the process, and a checksum of
+the solution. e.g.:
+
+  python bench.py > bench_output.txt
+  python bench.py --save bench_baseline.json
+  python bench.py --baseline bench_baseline.json
+
+when compared to a baseline, boards whose solution changed or that got
+significantly slower are flagged, and the exit status is nonzero. the
+checked-in bench_baseline.json is good for its checksums anywhere, but its
+timings only on the machine it was made on; save a fresh baseline before
+measuring a change
+
+the corpus is a directory of json files, each a payload as accepted by
+minesweeper_util.api_solve(). it is built by generate_corpus() from seeded
+random games, so it can be regenerated (--generate) or extended at will
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os.path
+import random
+import resource
+import sys
+import time
+
+import minesweeper as mnsw
+import minesweeper_util as u
+import game
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_corpus')
+
+# probabilities are rounded to this many places before checksumming, so the
+# checksum is immune to floating-point noise from summation order
+CHECKSUM_PRECISION = 6
+
+# a board has regressed if it is slower than baseline by both this factor...
+DEFAULT_TOLERANCE = .25
+# ...and this many seconds (to ignore noise in trivially fast boards)
+MIN_REGRESSION = .02
+
+# (name, game constructor, seed, fraction of safe cells to uncover, min
+# estimated enumeration cost of the position; see play_position())
+GAMES = [
+    ('beginner_early', game.BEGINNER, 1, .2, 10),
+    ('beginner_mid', game.BEGINNER, 2, .5, 10),
+    ('beginner_late', game.BEGINNER, 3, .75, 10),
+    ('intermediate_early', game.INTERMEDIATE, 1, .15, 50),
+    ('intermediate_mid', game.INTERMEDIATE, 2, .45, 100),
+    ('intermediate_late', game.INTERMEDIATE, 3, .75, 50),
+    ('expert_early', game.EXPERT, 1, .15, 500),
+    ('expert_mid', game.EXPERT, 2, .4, 5000),
+    ('expert_late', game.EXPERT, 3, .7, 1000),
+    ('torus_mid', 'TorusMinesweeperGame(16, 16, num_mines=45)', 1, .4, 100),
+    ('hex_mid', 'HexMinesweeperGame(20, 20, num_mines=60)', 1, .4, 100),
+    ('hex_late', 'HexMinesweeperGame(20, 20, num_mines=60)', 2, .7, 100),
+    ('huge_mid', 'GridMinesweeperGame(60, 60, num_mines=720)', 1, .5, 20000),
+]
+
+# chance that the player of play_position() uncovers a cell away from the
+# uncovered area rather than on its border. without such jumps, the border
+# is so thoroughly explored that little is left uncertain
+JUMP_RATE = .2
+# how far past 'stage' a position may be, before giving up on the game
+STAGE_WINDOW = .15
+
+def play_position(gamestr, seed, stage, min_cost=0):
+    """return a game in progress, as a (flawless) player might leave it: a
+    random game (per 'seed') opened at a cell with no adjacent mines, then
+    grown by uncovering random safe cells, mostly bordering the uncovered
+    area, until the fraction 'stage' of safe cells are uncovered
+
+    play carries on past 'stage' until the position is estimated to cost at
+    least 'min_cost' to enumerate (see minesweeper.estimate_cost()), so that
+    it is worth benchmarking; if that takes too long, a new game is dealt"""
+    for attempt in itertools.count():
+        random.seed(seed + 1000 * attempt)
+        g = eval(gamestr, vars(game))
+        num_safe = g.num_cells - g.num_mines
+
+        def covered_safe_cells(cells):
+            return [c for c in cells if g.cells[c] is None and not g.mines[c]]
+        g.sweep(random.choice([c for c in covered_safe_cells(g.cell_ids) if not any(g.mines[n] for n in g.adjacent(c))]))
+        while g.yet_to_uncover > (1. - stage - STAGE_WINDOW) * num_safe:
+            border = [c for c in covered_safe_cells(g.cell_ids) if any(g.cells[n] is not None for n in g.adjacent(c))]
+            # now and then (or if walled off by mines), jump elsewhere
+            g.sweep(random.choice(border if border and random.random() >= JUMP_RATE else covered_safe_cells(g.cell_ids)))
+            if g.yet_to_uncover <= (1. - stage) * num_safe and position_cost(g) >= min_cost:
+                return g
+
+def position_cost(g):
+    rules, mine_prevalence = u.parse_api_payload(game_payload(g))
+    return mnsw.estimate_cost(rules, 'enumerate')[0]
+
+def game_payload(g):
+    if type(g) is game.GridMinesweeperGame:
+        return board_payload(g)
+    else:
+        return rules_payload(g)
+
+def board_payload(g):
+    """api payload for a game on an ordinary grid, as an ascii board"""
+    code = lambda cell: {None: 'x', 'marked': '*', 0: '.'}.get(cell, str(cell))
+    board = '\n'.join(''.join(code(g.cells[(i, j)]) for i in xrange(g.width)) for j in xrange(g.height))
+    return {'board': board, 'total_mines': g.num_mines}
+
+def rules_payload(g):
+    """api payload for a game of any topology, as a set of rules"""
+    rules, mine_prevalence = u.generate_rules(game.BoardWrapper(g), g.num_mines)
+    name = lambda cell: '%d-%d' % cell
+    return {
+        'rules': [{'num_mines': r.num_mines, 'cells': sorted(map(name, r.cells))} for r in rules],
+        'total_cells': mine_prevalence.total_cells,
+        'total_mines': mine_prevalence.total_mines,
+    }
+
+def wall_payload(length, seed, density=.25):
+    """api payload for a pathological 'wall': a long row of alternating
+    uncovered and unknown cells, in the middle of a board of unknown cells.
+    this yields a single, long front with very many configurations. mines are
+    placed at random (per 'seed', with probability 'density') and the wall's
+    counts derived from them"""
+    rand = random.Random(seed)
+    # rows of unknown cells on either side of the wall; 2 columns of margin
+    # past each end, else the wall's ends pin down where its mines lie
+    width = length + 4
+    mines = [[rand.random() < density for i in xrange(width)] for j in xrange(3)]
+    def wall_cell(col):
+        if col < 2 or col >= width - 2 or col % 2:
+            return 'x'
+        return str(sum(mines[j][i] for j in xrange(3) for i in xrange(col - 1, col + 2) if (j, i) != (1, col)))
+    board = ['x' * width] * 2 + [''.join(wall_cell(col) for col in xrange(width))] + ['x' * width] * 2
+    return {'board': '\n'.join(board), 'total_mines': int(density * width * 5)}
+
+def chain_payload(length):
+    """api payload for a long chain of overlapping rules, each sharing cells
+    with its neighbors on both sides"""
+    rules = [{'num_mines': 1, 'cells': ['a%d' % j for j in xrange(2 * i, 2 * i + 3)] + ['b%d' % i]}
+             for i in xrange(length)]
+    return {'rules': rules, 'total_cells': 10 * length, 'total_mines': 3 * length}
+
+def generate_corpus(dir=CORPUS_DIR):
+    """(re-)build the benchmark corpus"""
+    payloads = []
+    for name, gamestr, seed, stage, min_cost in GAMES:
+        payloads.append((name, game_payload(play_position(gamestr, seed, stage, min_cost))))
+    payloads.extend([
+        ('wall_short', wall_payload(30, 1)),
+        ('wall_long', wall_payload(36, 5)),
+        ('wall_dense', wall_payload(30, 3, .35)),
+        ('chain', chain_payload(16)),
+    ])
+
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    for name, payload in payloads:
+        with open(os.path.join(dir, name + '.json'), 'w') as f:
+            json.dump(payload, f, indent=1, separators=(',', ': '), sort_keys=True)
+            f.write('\n')
+
+def load_corpus(dir=CORPUS_DIR, names=None):
+    """return list of (name, payload), in order of name"""
+    files = sorted(f for f in os.listdir(dir) if f.endswith('.json'))
+    corpus = []
+    for f in files:
+        name = f[:-len('.json')]
+        if names and name not in names:
+            continue
+        with open(os.path.join(dir, f)) as fp:
+            corpus.append((name, json.load(fp)))
+    return corpus
+
+def checksum(solution):
+    """digest of a solution that is insensitive to float noise"""
+    entries = sorted((str(cell), round(p, CHECKSUM_PRECISION)) for cell, p in solution.iteritems())
+    return hashlib.sha1(repr(entries)).hexdigest()[:12]
+
+def bench_board((payload, repeat)):
+    """solve a board 'repeat' times; return the results of the fastest run.
+    run in a fresh worker process, so that peak memory is the board's own"""
+    rules, mine_prevalence = u.parse_api_payload(payload)
+    best = None
+    for i in xrange(repeat):
+        # a benchmark of cache lookups would be no benchmark at all. but a
+        # persistent store may be shared with other processes, and is not ours
+        # to wipe; only its memory layer is dropped
+        if isinstance(mnsw.front_shape_cache, mnsw.FrontStore):
+            mnsw.front_shape_cache.clear_memory()
+        elif mnsw.front_shape_cache is not None:
+            mnsw.front_shape_cache.clear()
+        stats = mnsw.SolveStats()
+        start = time.time()
+        try:
+            solution = mnsw.solve(rules, mine_prevalence, '_other', stats=stats)
+            digest = checksum(solution)
+        except mnsw.InconsistencyError:
+            digest = 'inconsistent'
+        elapsed = time.time() - start
+        if best is None or elapsed < best['time']:
+            best = {
+                'time': elapsed,
+                'phases': dict(stats.timings),
+                'counters': dict(stats.counters),
+                'checksum': digest,
+            }
+    best['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return best
+
+def run(corpus, repeat=1):
+    """benchmark each board of the corpus; return mapping: name -> results"""
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        results = pool.map(bench_board, [(payload, repeat) for name, payload in corpus], chunksize=1)
+    finally:
+        pool.terminate()
+    return dict((name, result) for (name, payload), result in zip(corpus, results))
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """return mapping: name -> list of regressions (as descriptive strings) of
+    each board relative to the baseline"""
+    regressions = {}
+    for name, result in results.iteritems():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        flags = []
+        if result['checksum'] != base['checksum']:
+            flags.append('solution changed')
+        if result['time'] > base['time'] * (1. + tolerance) and result['time'] - base['time'] > MIN_REGRESSION:
+            flags.append('%.0f%% slower' % (100. * (result['time'] / base['time'] - 1.)))
+        if flags:
+            regressions[name] = flags
+    return regressions
+
+def report(results, baseline=None, regressions={}, out=sys.stdout):
+    phases = [p for p in mnsw.SolveStats.PHASES if any(r['phases'][p] for r in results.values())]
+    header = ['board', 'time', 'base'] + phases + ['fronts', 'configs', 'rss_mb', 'checksum']
+    rows = [header]
+    for name in sorted(results):
+        r = results[name]
+        base = (baseline or {}).get(name)
+        rows.append([name, '%.3f' % r['time'], '%.3f' % base['time'] if base else '--'] +
+                    ['%.3f' % r['phases'][p] for p in phases] +
+                    [str(r['counters'].get('fronts', 0)), str(r['counters'].get('configurations', 0)),
+                     '%.1f' % (r['peak_rss_kb'] / 1024.), r['checksum']] +
+                    (['  <-- ' + ', '.join(regressions[name])] if name in regressions else []))
+    widths = [max(len(row[i]) for row in rows if i < len(row)) for i in xrange(len(header))]
+    for row in rows:
+        print >> out, '  '.join(cell.ljust(w) if i == 0 else cell.rjust(w)
+                                for i, (cell, w) in enumerate(zip(row, widths))) + ''.join(row[len(header):])
+    print >> out, 'total %.3f' % sum(r['time'] for r in results.values())
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the solver over a corpus of boards')
+    parser.add_argument('boards', nargs='*', help='names of boards to run (default: all)')
+    parser.add_argument('--corpus', default=CORPUS_DIR, help='directory of board payloads')
+    parser.add_argument('--repeat', type=int, default=3, help='solve each board this many times; keep the fastest')
+    parser.add_argument('--baseline', help='json file of prior results to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='fraction slower than baseline that counts as a regression')
+    parser.add_argument('--save', help='write results to this json file, for use as a baseline')
+    parser.add_argument('--generate', action='store_true', help='(re-)build the corpus, then exit')
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.corpus)
+        return 0
+
+    results = run(load_corpus(args.corpus, args.boards), args.repeat)
+    baseline = None
+    regressions = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+    report(results, baseline, regressions)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, separators=(',', ': '), sort_keys=True)
+            f.write('\n')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -90,6 +90,27 @@ class GridMinesweeperGame(MinesweeperGame):
                     (ni, nj) != (i, j)):
                    yield (ni, nj)
 
+class TorusMinesweeperGame(GridMinesweeperGame):
+    """grid whose opposite edges wrap around to meet each other"""
+
+    def adjacent(self, cell):
+        i, j = cell
+        # set, as neighbors coincide on boards less than 3 cells across
+        neighbors = set(((i + di) % self.width, (j + dj) % self.height) for di in (-1, 0, 1) for dj in (-1, 0, 1))
+        neighbors.discard(cell)
+        return iter(neighbors)
+
+class HexMinesweeperGame(GridMinesweeperGame):
+    """grid of hexagons, with odd rows (j) shifted half a cell to the right"""
+
+    def adjacent(self, cell):
+        i, j = cell
+        shift = j % 2
+        for di, dj in ((-1, 0), (1, 0), (shift - 1, -1), (shift, -1), (shift - 1, 1), (shift, 1)):
+            ni, nj = i + di, j + dj
+            if ni >= 0 and ni < self.width and nj >= 0 and nj < self.height:
+                yield (ni, nj)
+
 class BoardWrapper(object):
     """convert the gameboard to a form recognizable by the generate_rules() utility function"""
 
@@ -118,6 +139,8 @@ class BoardWrapper(object):
 def autoplay(game, **kwargs):
     moves = 0
     hopeless = False
+    # fronts not touched by a move are carried over rather than re-enumerated
+    session = mnsw.SolverSession()
     while True:
         #print game
         #print '----'
@@ -125,10 +148,11 @@ def autoplay(game, **kwargs):
         if result is not None:
             return result, moves, hopeless
 
-        state = u.generate_rules(BoardWrapper(game), game.num_mines)
+        rules, mine_prevalence = u.generate_rules(BoardWrapper(game), game.num_mines)
         if game.mode == 'mineprob':
-            state[1] = game.mine_prob
-        solution = mnsw.solve(*state)
+            mine_prevalence = game.mine_prob
+        session.set_rules(rules)
+        solution = session.solve(mine_prevalence)
 
         def _cells(cells):
             for c in cells:
@@ -200,8 +224,12 @@ def run_trial(args):
     gamestr, kwargs = args
     return autoplay(eval(gamestr), **kwargs)
 
-def trial(new_game_str, tolerance=.5e-3, first_safe=True, threaded=True, **kwargs):
+def trial(new_game_str, tolerance=.5e-3, first_safe=True, threaded=True, front_store=None, **kwargs):
   try:
+    if front_store:
+        # shared by the worker processes, and by later trials
+        mnsw.open_front_store(front_store)
+
     total_games = 0
     total_wins = 0
     total_hopeless = 0
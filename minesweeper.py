@@ -1,15 +1,37 @@
 import collections
+import cPickle
+import hashlib
+import heapq
 import itertools
+import logging
 import operator
-import Queue
+import multiprocessing
+import os
+import random
+import sqlite3
+import threading
+import time
+import weakref
 from util import *
 
 set_ = frozenset
 
 class InconsistencyError(Exception):
     """raise when a game state is logically inconsistent."""
+
+class SolveCancelled(Exception):
+    """raise when a solve is stopped via its CancelToken"""
+
+class DeadlineExceeded(SolveCancelled):
+    """raise when a computation runs past its Deadline"""
     pass
 
+class CostExceeded(Exception):
+    """raise when a board is estimated to cost more to solve than allowed"""
+    def __init__(self, cost, max_cost):
+        super(CostExceeded, self).__init__('estimated cost %g exceeds limit of %g' % (cost, max_cost))
+        self.cost = cost
+
 """represents the board geometry for traditional minesweeper, where the board
 has fixed dimensions and fixed total # of mines.
 
@@ -19,11 +41,13 @@ total_mines: total # of mines contained within all cells
 """
 MineCount = collections.namedtuple('MineCount', ['total_cells', 'total_mines'])
 
-def solve(rules, mine_prevalence, other_tag=None):
+def solve(rules, mine_prevalence, other_tag=None, front_cache=None, cell_index=None, engine='enumerate',
+          executor=None, numeric='log', mode='exact', budget=None, seed=None, deadline=None, cancel=None,
+          stats=None, max_cost=None):
     """solve a minesweeper board.
 
-    take in a minesweeper board and return the solution as a dict mapping each
-    cell to its probability of being a mine.
+    take in a minesweeper board and return the solution as a dict (Solution)
+    mapping each cell to its probability of being a mine.
 
     rules -- a set of 'Rule' describing the board
     mine_prevalence -- an object describing the total expected mines on the
@@ -33,24 +57,474 @@ def solve(rules, mine_prevalence, other_tag=None):
         vary for given board dimensions, in a binomial distribution)
     other_tag -- tag used to represent all 'other' cells (all cells not
         mentioned in a rule) in the solution output
+    front_cache -- optional mapping in which to memoize the tally of each
+        front across calls, keyed by PermutedRuleset.fingerprint() (see
+        SolverSession)
+    cell_index -- CellIndex used to intern cells; only needs to be provided
+        if interned ids must stay stable across calls (as with front_cache)
+    engine -- method for tallying each front; one of TALLY_ENGINES:
+        'enumerate' -- walk every valid mine configuration
+        'count' -- dynamic programming over the front's structure; never
+            lists configurations, so much faster for long, thin fronts
+        'auto' -- whichever of the above is estimated to be cheaper, per
+            front (see front_cost())
+    executor -- optional process pool (anything with a map() method, such as
+        a multiprocessing.Pool that is kept around between calls) across which
+        to tally expensive fronts in parallel; see tally_fronts()
+    numeric -- arithmetic used to weight fronts against each other; one of
+        NUMERIC_BACKENDS:
+        'log' -- log-space floats; immune to overflow on boards of any size
+        'exact' -- exact integers and fractions; slow, but useful as a
+            reference
+    mode -- 'exact', or 'approximate' to estimate the tallies of fronts too
+        complex to enumerate by random sampling (see sample_front()); the
+        solution then carries confidence intervals
+    budget -- in approximate mode, the # of samples to draw per front
+        (default APPROXIMATE_BUDGET); fronts whose complexity is within the
+        budget are still tallied exactly
+    seed -- in approximate mode, optional seed for the random sampling
+    deadline -- optional time limit for the solve, in seconds (or a
+        Deadline). past it, logical reduction and cross-elimination stop
+        short, and fronts not yet tallied are instead estimated by a brief
+        sampling (see sample_front()), or failing that, by marginal_tally();
+        their cells are listed in the solution's 'estimated' set, and the
+        rest of the solution is as usual. the estimates take at most about
+        DEADLINE_FALLBACK_TIME more. in approximate mode, sampling also stops
+        at the deadline
+    cancel -- optional CancelToken, checked periodically throughout the
+        solve; once cancelled, the solve stops by raising SolveCancelled. its
+        progress callback, if any, is kept informed along the way
+    stats -- optional SolveStats to fill in
+    max_cost -- optional limit on the estimated cost of tallying all fronts
+        (see front_cost(); in approximate mode, only those tallied exactly).
+        past it, raise CostExceeded before tallying any of them
     """
+    if stats is not None:
+        stats.start()
+    if deadline is not None and not isinstance(deadline, Deadline):
+        deadline = Deadline(deadline, cancel)
+    token = deadline or cancel
+
+    cell_index = cell_index or CellIndex()
+    fronts, determined, all_cells = analyze(rules, cell_index, token, stats)
+    if stats is not None:
+        for front in fronts:
+            front.stats = stats
+
+    sampled_fronts = set()
+    if mode == 'approximate':
+        budget = budget or APPROXIMATE_BUDGET
+        sampled_fronts = set(f for f in fronts if f.complexity() > budget)
+        fronts -= sampled_fronts
+    elif mode != 'exact':
+        raise ValueError('unknown mode %r' % mode)
+
+    if max_cost is not None:
+        cost = sum(front_cost(front, engine) for front in fronts)
+        if cost > max_cost:
+            raise CostExceeded(cost, max_cost)
+
+    front_tallies = tally_fronts(fronts, front_cache, engine, executor, token, stats)
+    tallies = set(tally for tally in front_tallies.values() if tally is not None)
+    tallies.update(r.tally() for r in determined)
+    if stats is not None:
+        stats.lap('enumerate')
+
+    # fronts that ran out of time get only a quick estimate
+    unfinished_fronts = set(f for f, tally in front_tallies.iteritems() if tally is None)
+    if sampled_fronts or unfinished_fronts:
+        rand = random.Random(seed)
+        samples = [sample_front(front, budget, rand=rand, token=token) for front in sampled_fronts]
+        fallback_token = Deadline(DEADLINE_FALLBACK_TIME, cancel)
+        # fronts for which even that finds nothing in time get a cruder one
+        crude_fronts = set()
+        for front in unfinished_fronts:
+            front_samples = sample_front(front, DEADLINE_FALLBACK_BUDGET, rand=rand, token=fallback_token)
+            if any(batch.subtallies for batch in front_samples):
+                samples.append(front_samples)
+            else:
+                crude_fronts.add(front)
+                tallies.add(marginal_tally(front))
+        if stats is not None:
+            stats.lap('sample')
+        estimated = set(cell for cell, p in expand_cells(((cell_, 0.) for front in sampled_fronts | unfinished_fronts
+                                                          for cell_ in front.cells_), other_tag, cell_index.names))
+        if samples:
+            solution = approximate_solution(tallies, samples, mine_prevalence, all_cells, other_tag, cell_index.names,
+                                            NUMERIC_BACKENDS[numeric], estimated)
+            # no confidence to be had in the crude estimates
+            solution.intervals.update((cell, (0., 1.)) for cell, p in expand_cells(
+                ((cell_, 0.) for front in crude_fronts for cell_ in front.cells_), other_tag, cell_index.names))
+        else:
+            cell_probs = cell_probabilities(tallies, mine_prevalence, all_cells, NUMERIC_BACKENDS[numeric])
+            solution = Solution(expand_cells(cell_probs, other_tag, cell_index.names), estimated=estimated)
+        if stats is not None:
+            stats.lap('weight')
+        return solution
+
+    cell_probs = cell_probabilities(tallies, mine_prevalence, all_cells, NUMERIC_BACKENDS[numeric])
+    if stats is not None:
+        stats.lap('weight')
+    solution = Solution(expand_cells(cell_probs, other_tag, cell_index.names))
+    if stats is not None:
+        stats.lap('expand')
+    return solution
+
+def solve_many(problems, other_tag=None, engine='enumerate', executor=None, numeric='log', cancel=None,
+               stats=None):
+    """solve a batch of minesweeper boards at once
+
+    problems -- sequence of (rules, mine_prevalence), each as for solve()
+
+    other arguments are as for solve() (only exact solving is supported).
+    returns a list of solutions, in the order of 'problems'; a board that is
+    logically inconsistent gets None rather than failing the whole batch
+
+    the boards share their setup: cells are interned into a single CellIndex,
+    and the fronts of all boards are tallied together, so a front that
+    recurs across boards (even relabeled; see FrontShape) is tallied just
+    once, and those sent to 'executor' all go out in one round
+    """
+    if stats is not None:
+        stats.start()
+    cell_index = CellIndex()
+    # identical fronts across the boards of the batch
+    front_cache = {}
+
+    boards = []
+    for rules, mine_prevalence in problems:
+        try:
+            boards.append(analyze(rules, cell_index, cancel, stats))
+        except InconsistencyError:
+            boards.append(None)
+
+    all_fronts = set(f for board in boards if board for f in board[0])
+    if stats is not None:
+        for front in all_fronts:
+            front.stats = stats
+
+    try:
+        front_tallies = tally_fronts(all_fronts, front_cache, engine, executor, cancel, stats)
+    except InconsistencyError:
+        # isolate the inconsistent board(s). fronts already tallied are cached,
+        # and already in the stats; the rest are tallied (and recorded) anew
+        front_tallies = {}
+        for i, board in enumerate(boards):
+            if board is None:
+                continue
+            pending = set(f for f in board[0] if f.fingerprint() not in front_cache)
+            front_tallies.update((f, tally_front(f, front_cache)) for f in board[0] if f not in pending)
+            try:
+                front_tallies.update(tally_fronts(pending, front_cache, engine, executor, cancel, stats))
+            except InconsistencyError:
+                boards[i] = None
+    if stats is not None:
+        stats.lap('enumerate')
+
+    solutions = []
+    for (rules, mine_prevalence), board in zip(problems, boards):
+        if board is None:
+            solutions.append(None)
+            continue
+        fronts, determined, all_cells = board
+        tallies = set(front_tallies[f] for f in fronts)
+        tallies.update(r.tally() for r in determined)
+        try:
+            cell_probs = cell_probabilities(tallies, mine_prevalence, all_cells, NUMERIC_BACKENDS[numeric])
+            solutions.append(Solution(expand_cells(cell_probs, other_tag, cell_index.names)))
+        except InconsistencyError:
+            solutions.append(None)
+    if stats is not None:
+        stats.lap('weight')
+    return solutions
+
+def analyze(rules, cell_index, token=None, stats=None):
+    """the stages of solve() up to tallying: intern and condense the rules,
+    reduce them, and split them into independent fronts
+
+    return (non-trivial fronts (PermutedRulesets), trivial rules, all
+    supercells)
+    """
+    rules = [cell_index.intern_rule(rule) for rule in rules]
+
     rules, all_cells = condense_supercells(rules)
-    rules = reduce_rules(rules)
+    if stats is not None:
+        stats.lap('condense')
+        stats.count('rules', len(rules))
+        stats.count('supercells', len(all_cells))
+    rules = reduce_rules(rules, token)
+    if stats is not None:
+        stats.lap('reduce')
+        stats.count('rules_reduced', len(rules))
 
     determined = set(r for r in rules if r.is_trivial())
     rules -= determined
 
-    ruleset = permute_and_interfere(rules)
+    ruleset = permute_and_interfere(rules, token, stats)
     fronts = ruleset.split_fronts()
 
     trivial_fronts = set(f for f in fronts if f.is_trivial())
     determined |= set(f.trivial_rule() for f in trivial_fronts)
     fronts -= trivial_fronts
+    if stats is not None:
+        stats.lap('split')
+        stats.count('fronts', len(fronts))
+    return fronts, determined, all_cells
+
+def estimate_cost(rules, engine='auto'):
+    """estimate the cost (see front_cost()) of solving a board with the given
+    engine, without solving it. return the total and the costs of the
+    individual fronts, most expensive first. the board's mine prevalence
+    does not enter into it
+
+    useful to decide up front how (or whether) to solve a board: exactly,
+    approximately, or elsewhere
+    """
+    fronts, determined, all_cells = analyze(rules, CellIndex())
+    costs = sorted((front_cost(front, engine) for front in fronts), reverse=True)
+    return sum(costs), costs
+
+class CancelToken(object):
+    """a handle with which to stop a solve in progress and follow its
+    progress, e.g., from another thread. the solver calls checkpoint()
+    periodically, which raises SolveCancelled once cancel() has been called
+
+    tokens are picklable, so they can be handed to worker processes, though
+    only the state at the time of pickling (and no progress callback) carries
+    over
+    """
+
+    def __init__(self, progress=None):
+        """progress -- optional function(phase, count), called at checkpoints
+            with one of:
+            'reduce', # of rules active in logical reduction
+            'cross_eliminate', # of permutations eliminated so far
+            'enumerate', # of configurations of the current front enumerated
+                so far
+        """
+        self.progress = progress
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        """raise SolveCancelled if the solve is to stop"""
+        if self.cancelled:
+            raise SolveCancelled()
+
+    def checkpoint(self, phase, count):
+        """report progress, then check()"""
+        if self.progress is not None:
+            self.progress(phase, count)
+        self.check()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['progress'] = None
+        return state
+
+class Deadline(CancelToken):
+    """a cancel token that also expires at a set (wall-clock) time, upon
+    which check() raises DeadlineExceeded"""
+
+    def __init__(self, seconds, parent=None):
+        """seconds -- time allowed from now
+        parent -- optional CancelToken whose cancellation and progress
+            callback this token shares
+        """
+        super(Deadline, self).__init__(parent.progress if parent is not None else None)
+        self.parent = parent
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        """return the # of seconds left (negative if past)"""
+        return self.expires - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        """raise SolveCancelled if cancelled, or DeadlineExceeded if the
+        deadline has passed"""
+        if self.parent is not None:
+            self.parent.check()
+        super(Deadline, self).check()
+        if self.expired():
+            raise DeadlineExceeded()
+
+class Solution(dict):
+    """the solution to a board: mapping of cell -> probability of being a
+    mine
+
+    intervals -- for an approximate solution, mapping of cell -> (low, high)
+        confidence interval of its probability; None if the solution is
+        exact
+    estimated -- set of cells whose front was estimated by sampling rather
+        than tallied exactly (by choice or for lack of time). note that with
+        a fixed total # of mines, every probability depends somewhat on all
+        fronts, so 'intervals' is the better guide to accuracy
+    """
+
+    def __init__(self, probabilities, intervals=None, estimated=()):
+        super(Solution, self).__init__(probabilities)
+        self.intervals = intervals
+        self.estimated = set(estimated)
+
+class SolveStats(object):
+    """instrumentation of a single solve: wall time per phase, counters of the
+    work done, and a breakdown per front. pass one to solve() to have it
+    filled in; with none, the solver does no bookkeeping at all
+
+    timings -- mapping: phase -> seconds; see PHASES
+    counters -- mapping: counter -> count:
+        'rules' -- # of rules given
+        'supercells' -- # of supercells after condensing
+        'rules_reduced' -- # of rules after logical reduction
+        'permutations' -- # of permutations of all rules, before
+            cross-elimination
+        'elimination_checks' -- # of checks by cross-elimination of whether
+            a group of permutations still has support in an overlapping rule
+        'permutations_eliminated' -- # of permutations removed by
+            cross-elimination
+        'fronts' -- # of non-trivial fronts
+        'configurations' -- # of mine configurations enumerated
+        'cascades' -- # of rules constrained to a single permutation as a
+            knock-on effect of fixing another, during enumeration and sampling
+        configurations and cascades only cover fronts enumerated in this
+        process, and not those found in a cache
+    fronts -- list, per non-trivial front, of a dict with the front's
+        'cells', 'rules', 'permutations', 'complexity', estimated 'cost' per
+        engine (see ENGINE_COSTS), and the 'time' taken to tally it (None if
+        tallied by a worker process)
+    """
+
+    PHASES = ['condense', 'reduce', 'permute', 'cross_eliminate', 'rereduce', 'split',
+              'enumerate', 'sample', 'weight', 'expand']
+
+    def __init__(self):
+        self.timings = collections.OrderedDict((phase, 0.) for phase in self.PHASES)
+        self.counters = collections.defaultdict(int)
+        self.fronts = []
+        self.start()
+
+    def start(self):
+        """start timing the first phase"""
+        self.lap_start = time.time()
+
+    def lap(self, phase):
+        """attribute the time since the previous lap to 'phase'"""
+        now = time.time()
+        self.timings[phase] += now - self.lap_start
+        self.lap_start = now
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    def add_front(self, front, elapsed=None):
+        """record the breakdown of a tallied front"""
+        self.fronts.append({
+            'cells': sum(len(cell_) for cell_ in front.cells_),
+            'rules': len(front.rules),
+            'permutations': sum(len(permu_set.permus) for permu_set in front.permu_map.values()),
+            'complexity': front.complexity(),
+            'cost': dict((engine, estimate(front)) for engine, estimate in ENGINE_COSTS.iteritems()),
+            'time': elapsed,
+        })
+
+    def total_time(self):
+        return sum(self.timings.values())
+
+    def as_dict(self):
+        """return the stats as plain data, e.g., for serialization"""
+        return {
+            'timings': dict(self.timings),
+            'counters': dict(self.counters),
+            'fronts': list(self.fronts),
+        }
+
+class CellIndex(object):
+    """assignment of dense integer ids to cells
+
+    the solver interns all cells at its boundary so that the cell set of a
+    rule can be represented as a bitmask; cells are translated back to their
+    original names only when expanding the final solution
+    """
+
+    def __init__(self):
+        # mapping: cell -> id
+        self.ids = {}
+        # list of cells, indexed by id
+        self.names = []
+
+    def intern(self, cell):
+        """return the id for 'cell', assigning a new one if necessary"""
+        try:
+            return self.ids[cell]
+        except KeyError:
+            self.ids[cell] = len(self.names)
+            self.names.append(cell)
+            return self.ids[cell]
+
+    def intern_rule(self, rule):
+        """convert a 'Rule' over cell names into one over cell ids"""
+        return Rule(rule.num_mines, [self.intern(cell) for cell in rule.cells])
+
+def cells_mask(cells):
+    """return the bitmask for a set of interned cells, or None if the cells
+    are not interned (i.e., not non-negative ints)"""
+    try:
+        return reduce(operator.or_, (1 << cell for cell in cells), 0)
+    except (TypeError, ValueError):
+        return None
+
+class SolverSession(object):
+    """stateful solver for a board that changes incrementally from one solve
+    to the next, such as over the course of a game
+
+    the rules are maintained across calls, and the tally of each front is
+    memoized. a front whose rules are unaffected by the latest changes is
+    not re-enumerated; only the statistical weighting across all fronts is
+    recomputed
+    """
+
+    def __init__(self, rules=[], cache_size=256):
+        """
+        rules -- initial set of 'Rule'
+        cache_size -- max # of front tallies to retain across calls
+        """
+        # multiset of current rules: rule -> # of occurrences
+        self.rules = collections.defaultdict(int)
+        self.front_cache = LRUCache(cache_size)
+        # cached fronts are keyed by interned cell ids, so keep them stable
+        self.cell_index = CellIndex()
+        self.add_rules(rules)
+
+    def add_rules(self, rules):
+        """add rules to the board state"""
+        for rule in rules:
+            self.rules[rule] += 1
+
+    def remove_rules(self, rules):
+        """remove previously-added rules from the board state"""
+        for rule in rules:
+            if self.rules.get(rule, 0) == 0:
+                raise KeyError(rule)
+            self.rules[rule] -= 1
+            if self.rules[rule] == 0:
+                del self.rules[rule]
+
+    def set_rules(self, rules):
+        """replace the board state wholesale, e.g., when the full ruleset is
+        regenerated after each move. fronts that did not change still hit the
+        cache"""
+        self.rules.clear()
+        self.add_rules(rules)
 
-    stats = set(enumerate_front(f) for f in fronts)
-    stats.update(r.tally() for r in determined)
-    cell_probs = cell_probabilities(stats, mine_prevalence, all_cells)
-    return dict(expand_cells(cell_probs, other_tag))
+    def solve(self, mine_prevalence, other_tag=None, **kwargs):
+        """solve the current board state; see solve() for arguments"""
+        rules = [rule for rule, n in self.rules.iteritems() for i in xrange(n)]
+        return solve(rules, mine_prevalence, other_tag, front_cache=self.front_cache, cell_index=self.cell_index, **kwargs)
 
 class Rule(ImmutableMixin):
     """basic representation of an axiom from a minesweeper game: N mines
@@ -68,15 +542,17 @@ class Rule(ImmutableMixin):
         self.num_mines = num_mines
         self.cells = set_(cells)
 
-    def condensed(self, rule_supercells_map):
+    def condensed(self, supercells):
         """condense supercells and convert to a 'Rule_'
 
-        rule_supercells_map -- pre-computed supercell mapping
+        supercells -- pre-computed set of supercells covering this rule's
+            cells (see condense_supercells())
         """
         return Rule_(
             self.num_mines,
-            rule_supercells_map.get(self, set_()), # default to handle degenerate rules
-            len(self.cells)
+            supercells,
+            len(self.cells),
+            cells_mask(self.cells)
         )
 
     def _canonical(self):
@@ -94,12 +570,15 @@ class Rule_(ImmutableMixin):
     num_mines -- total # of mines
     num_cells -- total # of base cells
     cells_ -- set of supercells; each supercell a set of base cells
+    mask -- bitmask of all base cells, if cells are interned (see CellIndex);
+        otherwise None. allows set comparisons between rules as bitwise ops
     """
 
-    def __init__(self, num_mines, cells_, num_cells=None):
+    def __init__(self, num_mines, cells_, num_cells=None, mask=None):
         self.num_mines = num_mines
         self.cells_ = cells_
         self.num_cells = num_cells if num_cells is not None else sum(len(cell_) for cell_ in cells_)
+        self.mask = mask
 
         if self.num_mines < 0 or self.num_mines > self.num_cells:
             raise InconsistencyError('rule with negative mines / more mines than cells')
@@ -110,7 +589,8 @@ class Rule_(ImmutableMixin):
         if self.num_mines == 0 or self.num_mines == self.num_cells:
             for cell_ in self.cells_:
                 size = len(cell_)
-                yield Rule_(size if self.num_mines > 0 else 0, set_([cell_]), size)
+                yield Rule_(size if self.num_mines > 0 else 0, set_([cell_]), size,
+                            cells_mask(cell_) if self.mask is not None else None)
             # degenerate rules (no cells) disappear here
         else:
             yield self
@@ -120,7 +600,8 @@ class Rule_(ImmutableMixin):
         covering only the difference"""
         return Rule_(self.num_mines - subrule.num_mines,
                      self.cells_ - subrule.cells_,
-                     self.num_cells - subrule.num_cells)
+                     self.num_cells - subrule.num_cells,
+                     self.mask & ~subrule.mask if self.has_mask(subrule) else None)
 
     def permute(self):
         """generate all possible mine permutations of this rule"""
@@ -133,8 +614,15 @@ class Rule_(ImmutableMixin):
         'sub-rule' means this rule's cells are a subset of the parent rules'
         cells. equivalent rules are subrules of each other.
         """
+        if self.has_mask(parent):
+            # valid since both rules share the same supercell partitioning
+            return self.mask & ~parent.mask == 0
         return self.cells_.issubset(parent.cells_)
 
+    def has_mask(self, other):
+        """return whether both this rule and 'other' have cell bitmasks"""
+        return self.mask is not None and other.mask is not None
+
     def is_trivial(self):
         """return whether this rule is trivial, i.e., has only one permutation"""
         return len(self.cells_) == 1
@@ -173,21 +661,33 @@ def condense_supercells(rules):
     be a singleton supercell
     """
 
-    # for each cell, list of rules that cell appears in
-    cell_rules_map = map_reduce(rules, lambda rule: [(cell, rule) for cell in rule.cells], set_)
-    # for each 'list of rules appearing in', list of cells that share that ruleset (these cells
-    # thus only ever appear together in the same rules)
-    rules_supercell_map = map_reduce(cell_rules_map.iteritems(), lambda (cell, rules): [(rules, cell)], set_)
+    rules = list(rules)
+
+    # for each cell, a signature of the rules that cell appears in: the
+    # positions of those rules in 'rules', in increasing order. rules are
+    # identified by position so that they never need to be hashed
+    cell_signatures = collections.defaultdict(list)
+    for i, rule in enumerate(rules):
+        for cell in rule.cells:
+            cell_signatures[cell].append(i)
+    # for each signature, set of cells that share it (these cells thus only
+    # ever appear together in the same rules)
+    supercells = map_reduce(cell_signatures.iteritems(), lambda (cell, sig): [(tuple(sig), cell)], set_)
     # for each original rule, list of 'supercells' appearing in that rule
-    rule_supercells_map = map_reduce(rules_supercell_map.iteritems(), lambda (rules, cell_): [(rule, cell_) for rule in rules], set_)
+    rule_supercells = [[] for rule in rules]
+    for sig, cell_ in supercells.iteritems():
+        for i in sig:
+            rule_supercells[i].append(cell_)
+
+    return ([rule.condensed(set_(cells_)) for rule, cells_ in zip(rules, rule_supercells)], supercells.values())
 
-    return ([rule.condensed(rule_supercells_map) for rule in rules], rules_supercell_map.values())
+def reduce_rules(rules, token=None):
+    """reduce ruleset using logical deduction
 
-def reduce_rules(rules):
-    """reduce ruleset using logical deduction"""
+    token -- optional CancelToken to check as reduction proceeds"""
     rr = RuleReducer()
     rr.add_rules(rules)
-    return rr.reduce_all()
+    return rr.reduce_all(token)
 
 class Reduceable(ImmutableMixin):
     """during the logical deduction phase, if all rules are nodes in a graph,
@@ -218,9 +718,6 @@ class Reduceable(ImmutableMixin):
     def contains(self, rule):
         return rule in (self.superrule, self.subrule)
 
-    def contained_within(self, rules):
-        return all(r in rules for r in (self.superrule, self.subrule))
-    
     def _canonical(self):
         return (self.superrule, self.subrule)
 
@@ -255,6 +752,32 @@ class CellRulesMap(object):
         cell in common"""
         return reduce(operator.or_, (self.map[cell_] for cell_ in rule.cells_), set()) - set([rule])
 
+    def subset_relations(self, rule):
+        """return (sub-rules, super-rules) of 'rule' among the mapped rules,
+        i.e., rules whose cells are a subset/superset of its cells. rules
+        equivalent to 'rule' count only as sub-rules
+
+        works by counting, for each overlapping rule, the number of cells it
+        shares with 'rule' while walking the cells' rule lists; a rule that
+        shares all of its own cells is a sub-rule, and one that shares all
+        of 'rule's cells a super-rule. only overlapping rules are visited, and
+        no set comparisons are needed
+        """
+        hits = collections.defaultdict(int)
+        for cell_ in rule.cells_:
+            for rule_ov in self.map[cell_]:
+                hits[rule_ov] += 1
+        hits.pop(rule, None)
+
+        num_cells = len(rule.cells_)
+        subrules, superrules = [], []
+        for rule_ov, shared in hits.iteritems():
+            if shared == len(rule_ov.cells_):
+                subrules.append(rule_ov)
+            elif shared == num_cells:
+                superrules.append(rule_ov)
+        return subrules, superrules
+
     def interference_edges(self):
         """return pairs of all rules that overlap each other; each pair is
         represented twice ((a, b) and (b, a)) to support processing of
@@ -273,6 +796,9 @@ class CellRulesMap(object):
         sub-rulesets overlap each other. returns a set of partitions, each a
         set of rules.
         """
+        if all(rule.mask is not None for rule in self.rules):
+            return self._partition_masks()
+
         related_rules = dict((rule, self.overlapping_rules(rule)) for rule in self.rules)
         partitions = set()
         while related_rules:
@@ -283,6 +809,24 @@ class CellRulesMap(object):
                 del related_rules[rule]
         return partitions
             
+    def _partition_masks(self):
+        """partition() for rules with cell bitmasks; merge each rule into the
+        partitions it overlaps via bitwise tests rather than graph traversal"""
+        # list of (bitmask of all cells in partition, list of rules)
+        partitions = []
+        for rule in self.rules:
+            mask, rules = rule.mask, [rule]
+            disjoint = []
+            for partition in partitions:
+                if partition[0] & mask:
+                    mask |= partition[0]
+                    rules.extend(partition[1])
+                else:
+                    disjoint.append(partition)
+            disjoint.append((mask, rules))
+            partitions = disjoint
+        return set(set_(rules) for mask, rules in partitions)
+
     def cells_(self):
         """return all cells contained in ruleset"""
         return set_(self.map.keys())
@@ -298,8 +842,17 @@ class RuleReducer(object):
         self.active_rules = set()
         # reverse lookup for rules containing a given cell
         self.cell_rules_map = CellRulesMap()
-        # current list of all possible reductions
-        self.candidate_reductions = Queue.PriorityQueue()
+        # current list of all possible reductions, as a heap of
+        # (priority, sequence #, reduction, superrule serial, subrule serial)
+        self.candidate_reductions = []
+        # mapping: active rule -> serial # assigned when it was added. a rule
+        # re-added after removal gets a new serial, so stale reductions never
+        # come back to life
+        self.rule_serials = {}
+        self.serials = itertools.count()
+        # tie-breaker for reductions of equal priority; keeps heap comparisons
+        # from ever falling through to the reductions themselves
+        self.sequence = itertools.count()
         
     def add_rules(self, rules):
         """add a set of rules to the ruleset"""
@@ -313,38 +866,50 @@ class RuleReducer(object):
 
     def add_base_rule(self, rule):
         """helper for adding a rule"""
+        if rule in self.rule_serials:
+            # already active; all its reductions are already queued
+            return
         self.active_rules.add(rule)
+        self.rule_serials[rule] = next(self.serials)
         self.cell_rules_map.add_rule(rule)
         self.update_reduceables(rule)
 
     def add_reduceable(self, reduc):
-        # priority queue priorities are lowest first
+        # heap priorities are lowest first
         prio = tuple(-k for k in reduc.metric())
-        self.candidate_reductions.put((prio, reduc))
+        heapq.heappush(self.candidate_reductions, (prio, next(self.sequence), reduc,
+                                                   self.rule_serials[reduc.superrule],
+                                                   self.rule_serials[reduc.subrule]))
         
     def update_reduceables(self, rule):
         """update the index of which rules are reduceable from others"""
-        rules_ov = self.cell_rules_map.overlapping_rules(rule)
-        for rule_ov in rules_ov:
-            if rule_ov.is_subrule_of(rule):
-                # catches if rules are equivalent
-                self.add_reduceable(Reduceable(rule, rule_ov))
-            elif rule.is_subrule_of(rule_ov):
-                self.add_reduceable(Reduceable(rule_ov, rule))
+        subrules, superrules = self.cell_rules_map.subset_relations(rule)
+        for rule_ov in subrules:
+            # catches if rules are equivalent
+            self.add_reduceable(Reduceable(rule, rule_ov))
+        for rule_ov in superrules:
+            self.add_reduceable(Reduceable(rule_ov, rule))
 
     def remove_rule(self, rule):
         """remove a rule from the active ruleset/index, presumably because it
         was reduced"""
         self.active_rules.remove(rule)
+        del self.rule_serials[rule]
         self.cell_rules_map.remove_rule(rule)
-        # we can't remove the inner contents of candidate_reductions queue; items
+        # we can't remove the inner contents of candidate_reductions heap; items
         # are checked for validity when they're popped
 
+    def is_live(self, rule, serial):
+        """return whether 'rule' is still active, and is the same instance
+        of it (per 'serial') that a reduction was queued against"""
+        return self.rule_serials.get(rule) == serial
+
     def pop_best_reduction(self):
         """get the highest-value reduction to perform next"""
-        while not self.candidate_reductions.empty():
-            reduction = self.candidate_reductions.get()[1]
-            if not reduction.contained_within(self.active_rules):
+        while self.candidate_reductions:
+            _, _, reduction, super_serial, sub_serial = heapq.heappop(self.candidate_reductions)
+            if not (self.is_live(reduction.superrule, super_serial) and
+                    self.is_live(reduction.subrule, sub_serial)):
                 continue
             return reduction
         return None
@@ -355,51 +920,186 @@ class RuleReducer(object):
         self.remove_rule(reduction.superrule)
         self.add_rule(reduced_rule)
 
-    def reduce_all(self):
-        """run the manager"""
+    def reduce_all(self, token=None):
+        """run the manager
+
+        token -- optional CancelToken, checked before each reduction. if it
+            is a Deadline, reduction merely stops once it passes; the rules
+            left still describe the board, only less simply"""
         while True:
+            if token is not None:
+                try:
+                    token.checkpoint('reduce', len(self.active_rules))
+                except DeadlineExceeded:
+                    break
             reduction = self.pop_best_reduction()
             if not reduction:
                 break
             self.reduce(reduction)
         return self.active_rules
 
+class CellOrder(object):
+    """a fixed ordering of a set of supercells, shared by all the
+    Permutations over that set. a permutation then need only store its mine
+    counts, positionally
+
+    orders are interned by cell set (see get()), so Permutations over the
+    same cells always share the same order object
+    """
+
+    # mapping: set of supercells -> CellOrder; entries vanish once no
+    # permutation refers to them. shared by solves in concurrent threads, so
+    # new entries are made under the lock
+    _interned = weakref.WeakValueDictionary()
+    _interned_lock = threading.Lock()
+
+    def __init__(self, cells_):
+        self.cells_ = tuple(cells_)
+        self.sizes = tuple(len(cell_) for cell_ in self.cells_)
+        # mapping: supercell -> position
+        self.index = dict((cell_, i) for i, cell_ in enumerate(self.cells_))
+
+        # memoized relationships with other orders, keyed by the other order;
+        # see methods below. weakly keyed, so that neither these nor the
+        # interning above keep orders alive once no permutation refers to them
+        self._overlaps = weakref.WeakKeyDictionary()
+        self._suborders = weakref.WeakKeyDictionary()
+        self._unions = weakref.WeakKeyDictionary()
+        self._multiplicities = None
+
+    @staticmethod
+    def get(cells_):
+        """return the interned order for a set of supercells"""
+        key = set_(cells_)
+        order = CellOrder._interned.get(key)
+        if order is None:
+            with CellOrder._interned_lock:
+                # another thread may have got here first
+                order = CellOrder._interned.get(key)
+                if order is None:
+                    order = CellOrder(key)
+                    CellOrder._interned[key] = order
+        return order
+
+    def overlap(self, other):
+        """return the positions of the cells in common with order 'other', as
+        (positions in this order, positions in 'other')"""
+        try:
+            return self._overlaps[other]
+        except KeyError:
+            common = [cell_ for cell_ in self.cells_ if cell_ in other.index]
+            overlap = (tuple(self.index[cell_] for cell_ in common), tuple(other.index[cell_] for cell_ in common))
+            self._overlaps[other] = overlap
+            return overlap
+
+    def suborder(self, subcells):
+        """return (order for 'subcells', positions of those cells in this
+        order)"""
+        suborder = CellOrder.get(subcells)
+        try:
+            return (suborder, self._suborders[suborder])
+        except KeyError:
+            positions = tuple(self.index[cell_] for cell_ in suborder.cells_)
+            self._suborders[suborder] = positions
+            return (suborder, positions)
+
+    def union(self, other):
+        """return (order for the cells in this and order 'other', sources),
+        where sources gives for each combined position (0 for this order or 1
+        for 'other', position therein)"""
+        try:
+            return self._unions[other]
+        except KeyError:
+            union = CellOrder.get(set_(self.cells_) | set_(other.cells_))
+            sources = tuple((0, self.index[cell_]) if cell_ in self.index else (1, other.index[cell_])
+                            for cell_ in union.cells_)
+            self._unions[other] = (union, sources)
+            return self._unions[other]
+
+    def multiplicities(self):
+        """return, for each position, a table of # mines -> multiplicity
+        (see Permutation.multiplicity()), or None for singleton cells, whose
+        multiplicity is always 1"""
+        if self._multiplicities is None:
+            self._multiplicities = tuple([choose(size, n) for n in xrange(size + 1)] if size > 1 else None
+                                         for size in self.sizes)
+        return self._multiplicities
+
+    def __reduce__(self):
+        return (CellOrder.get, (self.cells_,))
+
 class Permutation(ImmutableMixin):
-    """a single permutation of N mines among a set of (super)cells"""
+    """a single permutation of N mines among a set of (super)cells
+
+    stored compactly as a tuple of mine counts aligned with a shared
+    CellOrder
+    """
+
+    __slots__ = ('order', 'counts', '_hash')
 
     def __init__(self, mapping):
         """mapping -- a mapping: supercell -> # of mines therein
 
         cell set is determined implicitly from mapping, so all cells in set
         must have an entry, even if they have 0 mines"""
-        self.mapping = dict(mapping)
+        mapping = dict(mapping)
+        self.order = CellOrder.get(mapping)
+        self.counts = tuple(mapping[cell_] for cell_ in self.order.cells_)
+        self._hash = None
+
+    @staticmethod
+    def from_counts(order, counts):
+        """build directly from a CellOrder and aligned tuple of mine counts"""
+        permu = Permutation.__new__(Permutation)
+        permu.order = order
+        permu.counts = counts
+        permu._hash = None
+        return permu
+
+    @property
+    def mapping(self):
+        """mapping: supercell -> # of mines therein"""
+        return dict(self.iteritems())
+
+    def iteritems(self):
+        """iterate over (supercell, # of mines therein)"""
+        return itertools.izip(self.order.cells_, self.counts)
+
+    def __getitem__(self, cell_):
+        """return the # of mines in the given supercell"""
+        return self.counts[self.order.index[cell_]]
 
     def subset(self, subcells):
         """return a sub-permutation containing only the cells in 'subcells'"""
-        return Permutation((cell, self.mapping[cell]) for cell in subcells)
+        suborder, positions = self.order.suborder(subcells)
+        counts = self.counts
+        return Permutation.from_counts(suborder, tuple(counts[i] for i in positions))
 
     def compatible(self, permu):
         """return whether this permutation is consistent with 'permu', meaning
         the cells they have in common have matching numbers of mines assigned"""
-        overlap = self.cells() & permu.cells()
-        return self.subset(overlap) == permu.subset(overlap)
+        if self.order is permu.order:
+            return self.counts == permu.counts
+        positions, other_positions = self.order.overlap(permu.order)
+        a, b = self.counts, permu.counts
+        return all(a[i] == b[j] for i, j in itertools.izip(positions, other_positions))
 
     def combine(self, permu):
         """return a new permutation by combining this permutation with
         'permu'
         the permutations must be compatible!"""
-        assert all(permu.mapping[k] == v for k, v in self.mapping.iteritems() if k in permu.mapping)
-        mapping = dict(self.mapping)
-        mapping.update(permu.mapping)
-        return Permutation(mapping)
+        assert self.compatible(permu)
+        union, sources = self.order.union(permu.order)
+        counts = (self.counts, permu.counts)
+        return Permutation.from_counts(union, tuple(counts[src][i] for src, i in sources))
 
     def k(self):
         """return total # mines in this permutation"""
-        return sum(self.mapping.values())
+        return sum(self.counts)
 
     def cells(self):
         """return set of cells in this permutation"""
-        return set(self.mapping)
+        return set(self.order.cells_)
 
     def multiplicity(self):
         """count the # of permutations this permutation would correspond to if
@@ -408,41 +1108,47 @@ class Permutation(ImmutableMixin):
         e.g., N mines in a supercell of M cells has (M choose N) actual
         configurations
         """
-        return product(choose(len(cell_), k) for cell_, k in self.mapping.iteritems())
+        return product(table[k] for table, k in itertools.izip(self.order.multiplicities(), self.counts) if table is not None)
 
     def _canonical(self):
-        return tuple(sorted(self.mapping.iteritems(), key=lambda (k, v): hash(k)))
+        return (self.order, self.counts)
+
+    # equal permutations necessarily share the same interned order, so
+    # hash/compare on counts alone
+    def __eq__(self, o):
+        return type(o) == Permutation and self.order is o.order and self.counts == o.counts
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.counts)
+        return self._hash
+
+    def __reduce__(self):
+        return (Permutation, (tuple(self.iteritems()),))
 
     def __repr__(self):
-        cell_counts = sorted([(sorted(list(cell)), count) for cell, count in self.mapping.iteritems()])
+        cell_counts = sorted([(sorted(list(cell)), count) for cell, count in self.iteritems()])
         cell_frags = ['%s:%d' % (','.join(str(c) for c in cell), count) for cell, count in cell_counts]
         return '{%s}' % ' '.join(cell_frags)
 
-def permute(count, cells, permu=None):
-    """generate all permutations of 'count' mines among 'cells'
-
-    permu -- the sub-permutation in progress, when called as a recursive
-        helper function. not actually a Permutation object, but a set of
-        (key, value) pairs
-    """
-
-    def permu_add(*k):
-        return permu.union(k)
-
-    if permu is None:
-        permu = set()
+def permute(count, cells):
+    """generate all permutations of 'count' mines among 'cells'"""
+    order = CellOrder.get(cells)
+    for counts in _permute_counts(count, order.sizes):
+        yield Permutation.from_counts(order, counts)
 
+def _permute_counts(count, sizes):
+    """helper for permute(); generate all tuples of per-supercell mine counts
+    summing to 'count', given the supercell sizes"""
     if count == 0:
-        yield Permutation(permu_add(*[(cell, 0) for cell in cells]))
+        yield (0,) * len(sizes)
     else:
-        remaining_size = sum(len(cell) for cell in cells)
+        remaining_size = sum(sizes)
         if remaining_size == count:
-            yield Permutation(permu_add(*[(cell, len(cell)) for cell in cells]))
-        elif remaining_size >= count:
-            cell = cells[0]
-            for multiplicity in range(min(count, len(cell)), -1, -1):
-                for p in permute(count - multiplicity, cells[1:], permu_add((cell, multiplicity))):
-                    yield p
+            yield tuple(sizes)
+        elif remaining_size > count:
+            for multiplicity in range(min(count, sizes[0]), -1, -1):
+                for rest in _permute_counts(count - multiplicity, sizes[1:]):
+                    yield (multiplicity,) + rest
 
 class PermutationSet(object):
     """a set of permutations of the same cell set and total # of mines
@@ -483,7 +1189,7 @@ class PermutationSet(object):
         note that the set generated from self.to_rule().from_rule() may not
         match this set, as it cannot account for permutations removed from
         this set due to conflicts"""
-        return Rule_(self.k, self.cells_)
+        return Rule_(self.k, self.cells_, mask=cells_mask(itertools.chain(*self.cells_)))
 
     def __iter__(self):
         """return an iterator over the set of permutations"""
@@ -523,54 +1229,85 @@ class PermutationSet(object):
         full permu-sets decompose to themselves"""
         return self._decompose() if self.constrained else [self]
 
-    def _decompose(self, k_floor=1):
+    def _decompose(self):
         """determine if the permutation set is the cartesian product of N
         smaller permutation sets; return the decomposition if so
 
         this set may be constrained, in which case at least one subset of the
         decomposition (if one exists) will also be constrained
         """
-        for _k in range(k_floor, int(.5 * len(self.cells_)) + 1):
-            for cell_subset in (set_(c) for c in itertools.combinations(self.cells_, _k)):
-                try:
-                    permu_subset, permu_remainder = self.split(cell_subset)
-                except ValueError:
-                    continue
-
-                # lo, a cartesian divisor!
-                divisors = [permu_subset]
-                divisors.extend(permu_remainder._decompose(_k))
-                return divisors
-
-        return [self]
-
-    def split(self, cell_subset):
-        """helper function for decompose(). given a subset of cells, return
-        the two permutation sets for the subset and the set of remaining
-        cells, provided cell_subset is a valid decomposor; raise exception if
-        not"""
-        cell_remainder = self.cells_ - cell_subset
-        permu_subset = self.subset(cell_subset)
-        # exception thrown if subset cannot be a cartesian divisor; i.e., set
-        # of permutations could not have originated from single 'choose'
-        # operation
-
-        # get the remaining permutation sets for each sub-permutation
-        permu_remainders = set(map_reduce(self.permus,
-            emitfunc=lambda p: [(p.subset(cell_subset), p)],
-            reducefunc=lambda pv: set_(p.subset(cell_remainder) for p in pv)
-        ).values())
-        if len(permu_remainders) > 1:
-            # remaining subsets are not identical for each sub-permutation; not
-            # a cartesian divisor
-            raise ValueError()
-        permu_remainders = permu_remainders.pop()
-
-        return (permu_subset, PermutationSet(cell_remainder, self.k - permu_subset.k, permu_remainders))
+        if not self.permus:
+            return [self]
+
+        factors = self.factor_cells()
+        if len(factors) == 1:
+            return [self]
+        # factors of a set of constant # of mines always have constant # of
+        # mines themselves, so subset() won't object
+        return [self.subset(set_(factor)) for factor in factors]
+
+    def factor_cells(self):
+        """return the finest partition of the cells such that the set is the
+        cartesian product of its projections onto each part
+
+        built up one cell at a time. given the factors of the projection onto
+        the cells seen so far, the next cell merges with exactly those factors
+        that no longer split off from the rest on their own. a split is
+        tested by size alone: a set is always contained within the cartesian
+        product of its projections, and so equals it if the sizes agree
+        """
+        # list of (cells in factor, # of distinct projections onto factor)
+        factors = []
+        cells_so_far = []
+        for cell_ in self.cells_:
+            cells_so_far.append(cell_)
+            num_total = self.num_projected(cells_so_far)
+
+            merged = [cell_]
+            kept = []
+            for factor, num_factor in factors:
+                remainder = [c for c in cells_so_far if c not in factor]
+                if num_total == num_factor * self.num_projected(remainder):
+                    kept.append((factor, num_factor))
+                else:
+                    merged.extend(factor)
+            kept.append((merged, self.num_projected(merged)))
+            factors = kept
+        return [factor for factor, _ in factors]
+
+    def num_projected(self, cells_):
+        """return the # of distinct mine configurations amongst 'cells_' (a
+        sequence of supercells) across all permutations in the set"""
+        return len(set(itertools.imap(Projector(cells_), self.permus)))
 
     def __repr__(self):
         return str(list(self.permus))
 
+class Projector(object):
+    """function object that projects a Permutation onto a fixed sequence of
+    its cells, returning the mine counts therein; used as a hash key for
+    matching permutations across overlapping rules"""
+
+    def __init__(self, common):
+        """common -- sequence of supercells to project onto"""
+        self.common = common
+        # mapping: CellOrder -> getter of the counts at the common positions
+        self.getters = {}
+
+    def __call__(self, permu):
+        try:
+            getter = self.getters[permu.order]
+        except KeyError:
+            positions = [permu.order.index[cell_] for cell_ in self.common]
+            # itemgetter() only returns a tuple for 2+ items
+            getter = operator.itemgetter(*positions) if len(positions) != 1 else (lambda counts, i=positions[0]: (counts[i],))
+            self.getters[permu.order] = getter
+        return getter(permu.counts)
+
+# # of cheap steps (such as permutation eliminations) between checks of a
+# CancelToken
+CHECKPOINT_INTERVAL = 256
+
 class PermutedRuleset(object):
     """a set of rules and the available permutations for each, eliminating
     permutations which are mutually-inconsistent across the ruleset"""
@@ -590,35 +1327,81 @@ class PermutedRuleset(object):
             return PermutationSet.from_rule(r) if permu_map is None else permu_map[r]
         # a mapping: rule -> PermutationSet for that rule
         self.permu_map = dict((rule, rule_permuset(rule)) for rule in rules)
+        # optional SolveStats to count the work of enumerating this ruleset in
+        self.stats = None
 
-    def cross_eliminate(self):
+    def cross_eliminate(self, token=None):
         """determine what permutations are possible for each rule, taking
         into account the constraints of all overlapping rules. eliminate
-        impossible permutations"""
-
-        interferences = self.cell_rules_map.interference_edges()
-
-        # we can't simply iterate through 'interferences', as eliminating a
-        # permutation in a rule may in turn invalidate permutations in other
-        # overlapping rules that have already been processed, thus causing a
-        # cascade effect
-        while interferences:
-            r, r_ov = interferences.pop()
-            changed = False
-            for permu in list(self.permu_map[r]): #copy iterable so we can modify original
-                if self.permu_map[r_ov].compatible(permu).empty():
-                    # this permutation has no compatible permutation in the overlapping
-                    # rule. thus, it can never occur
-                    self.permu_map[r].remove(permu)
-                    changed = True
+        impossible permutations
 
+        token -- optional CancelToken, checked every CHECKPOINT_INTERVAL
+            eliminations. if it is a Deadline, elimination merely stops once
+            it passes, leaving some impossible permutations in place
+
+        returns (# of support checks made, # of permutations eliminated)
+
+        for each pair of overlapping rules, the permutations of each rule are
+        indexed by their projection onto the cells the rules have in common.
+        a permutation is supported by the overlapping rule as long as the
+        corresponding bucket of the other rule is non-empty, so eliminating a
+        permutation only requires checking the buckets it belonged to
+        """
+
+        # mapping: (rule, overlapping rule) -> projection onto common cells -> set of
+        #   permutations of rule with that projection
+        buckets = {}
+        # mapping: (rule, overlapping rule) -> function: permutation of rule -> projection
+        projectors = {}
+        for r, r_ov in self.cell_rules_map.interference_edges():
+            if (r_ov, r) in projectors:
+                # both directions must project onto the common cells in the same order
+                common = projectors[(r_ov, r)].common
+            else:
+                common = tuple(cell_ for cell_ in r.cells_ if cell_ in r_ov.cells_)
+            project = projectors[(r, r_ov)] = Projector(common)
+            buckets[(r, r_ov)] = map_reduce(self.permu_map[r], lambda p: [(project(p), p)], set)
+
+        # permutations pending elimination, as (rule, permutation)
+        unsupported = []
+        num_checks = 0
+        for (r, r_ov), index in buckets.iteritems():
+            support = buckets[(r_ov, r)]
+            num_checks += len(index)
+            for projection, permus in index.iteritems():
+                if projection not in support:
+                    # these permutations have no compatible permutation in the
+                    # overlapping rule. thus, they can never occur
+                    unsupported.extend((r, p) for p in permus)
+
+        # eliminating a permutation may in turn leave permutations in other
+        # overlapping rules without support, thus causing a cascade effect
+        num_eliminated = 0
+        while unsupported:
+            r, permu = unsupported.pop()
+            if permu not in self.permu_map[r]:
+                # already eliminated
+                continue
+            self.permu_map[r].remove(permu)
+            num_eliminated += 1
             if self.permu_map[r].empty():
                 # no possible configurations for this rule remain
                 raise InconsistencyError('rule is constrained such that it has no valid mine permutations')
-            elif changed:
-                # other rules overlapping with this one must be recalculated
-                for r_other in self.cell_rules_map.overlapping_rules(r):
-                    interferences.add((r_other, r))
+            if token is not None and num_eliminated % CHECKPOINT_INTERVAL == 0:
+                try:
+                    token.checkpoint('cross_eliminate', num_eliminated)
+                except DeadlineExceeded:
+                    break
+
+            for r_ov in self.cell_rules_map.overlapping_rules(r):
+                index = buckets[(r, r_ov)]
+                projection = projectors[(r, r_ov)](permu)
+                index[projection].remove(permu)
+                num_checks += 1
+                if not index[projection]:
+                    del index[projection]
+                    unsupported.extend((r_ov, p) for p in buckets[(r_ov, r)].get(projection, []))
+        return num_checks, num_eliminated
 
     def rereduce(self):
         """after computing the possible permutations of the rules, analyze and
@@ -690,30 +1473,59 @@ class PermutedRuleset(object):
 
         return singleton
 
-    def enumerate(self):
-        """enumerate all possible mine configurations for this ruleset"""
-        for mineconfig in EnumerationState(self).enumerate():
+    def complexity(self):
+        """return a crude upper bound on the # of configurations of this
+        ruleset: the product of the # of permutations of each rule"""
+        return product(len(permu_set.permus) for permu_set in self.permu_map.values())
+
+    def fingerprint(self):
+        """return a hashable key that fully identifies this ruleset, including
+        which permutations remain for each rule. two fronts with the same
+        fingerprint have identical tallies"""
+        return set_((rule, set_(permu_set)) for rule, permu_set in self.permu_map.iteritems())
+
+    def enumerate(self, token=None):
+        """enumerate all possible mine configurations for this ruleset
+
+        token -- optional CancelToken, checked as enumeration proceeds
+        """
+        for mineconfig in EnumerationState(self).enumerate(token):
             yield mineconfig
 
     def __repr__(self):
         import pprint
         return 'PermutedRuleset(\n %s)' % pprint.pformat(self.permu_map)
 
-def permute_and_interfere(rules):
+def permute_and_interfere(rules, token=None, stats=None):
     """process the set of rules and analyze the relationships and constraints
-    among them"""
+    among them
+
+    token -- optional CancelToken to check as analysis proceeds
+    stats -- optional SolveStats to record the time of each step in"""
     ruleset = PermutedRuleset(rules)
-    ruleset.cross_eliminate()
-    ruleset.rereduce()
+    if stats is not None:
+        stats.lap('permute')
+        stats.count('permutations', sum(len(permu_set.permus) for permu_set in ruleset.permu_map.values()))
+    num_checks, num_eliminated = ruleset.cross_eliminate(token)
+    if stats is not None:
+        stats.lap('cross_eliminate')
+        stats.count('elimination_checks', num_checks)
+        stats.count('permutations_eliminated', num_eliminated)
+    if not (isinstance(token, Deadline) and token.expired()):
+        ruleset.rereduce()
+    if stats is not None:
+        stats.lap('rereduce')
     return ruleset
 
 class EnumerationState(object):
     """a helper object to enumerate through all possible mine configurations of
     a ruleset"""
 
-    def __init__(self, ruleset=None):
+    def __init__(self, ruleset=None, token=None):
         """
         ruleset -- None when cloning an existing state
+        token -- optional CancelToken to check while building the
+            compatibility index
         """
         if ruleset is None:
             # 'naked' object for cloning
@@ -725,25 +1537,34 @@ class EnumerationState(object):
         # subset of ruleset whose permutations are still 'open'
         self.free = dict((rule, set(permu_set)) for rule, permu_set in ruleset.permu_map.iteritems())
 
+        # order of all supercells in the ruleset, for building mine configurations
+        self.order = CellOrder.get(ruleset.cells_)
+        # SolveStats to count configurations and cascades in, if any
+        self.stats = ruleset.stats
+
         # helper function (closure)
         self.overlapping_rules = lambda rule: ruleset.cell_rules_map.overlapping_rules(rule)
         # index for constraining overlapping permutations
         # mapping: (permutation, overlapping rule) -> PermutationSet of valid permutations for overlapping rule
-        self.compatible_rule_index = self.build_compatibility_index(ruleset.permu_map)
+        self.compatible_rule_index = self.build_compatibility_index(ruleset.permu_map, token)
             
     def clone(self):
         """clone this state"""
         state = EnumerationState()
         state.fixed = set(self.fixed)
         state.free = dict((rule, set(permu_set)) for rule, permu_set in self.free.iteritems())
+        state.order = self.order
+        state.stats = self.stats
         state.overlapping_rules = self.overlapping_rules
         state.compatible_rule_index = self.compatible_rule_index
         return state
 
-    def build_compatibility_index(self, rspm):
+    def build_compatibility_index(self, rspm, token=None):
         """build the constraint index"""
         index = {}
         for rule, permu_set in rspm.iteritems():
+            if token is not None:
+                token.check()
             for permu in permu_set:
                 for rule_ov in self.overlapping_rules(rule):
                     index[(permu, rule_ov)] = rspm[rule_ov].compatible(permu)
@@ -799,39 +1620,89 @@ class EnumerationState(object):
         # cascade if any other rules are now fully constrained
         for related_rule, constrained_permu in cascades:
             if related_rule in self.free: # may have already been constrained by prior recurisve call
+                if self.stats is not None:
+                    self.stats.count('cascades')
                 self._propogate(related_rule, constrained_permu)
 
+    def select_rule(self):
+        """pick the 'open' rule to branch on when splitting the search: the
+        most constrained, i.e., with the fewest remaining permutations"""
+        return min(self.free, key=lambda rule: len(self.free[rule]))
+
+    def split(self, min_states, max_depth=8):
+        """expand the search tree breadth-first, fixing permutations of the
+        most-constrained rules, until there are at least 'min_states' states
+        or the tree has been expanded 'max_depth' levels. the configurations of
+        the returned states together cover all configurations of this state
+
+        returns a list of (path, state), where path is the list of (rule,
+        permutation) choices that produces that state via propogate()
+        """
+        frontier = [([], self)]
+        for depth in xrange(max_depth):
+            if len(frontier) >= min_states or all(state.is_complete() for path, state in frontier):
+                break
+
+            expanded = []
+            for path, state in frontier:
+                if state.is_complete():
+                    expanded.append((path, state))
+                    continue
+                rule = state.select_rule()
+                for permu in state.free[rule]:
+                    try:
+                        expanded.append((path + [(rule, permu)], state.propogate(rule, permu)))
+                    except ValueError:
+                        # conflict detected; dead end
+                        pass
+            frontier = expanded
+        return frontier
+
     def mine_config(self):
         """convert the set of fixed permutations into a single Permutation
         encompassing the mine configuration for the entire ruleset"""
-        return reduce(lambda a, b: a.combine(b), self.fixed)
-
-    def enumerate(self):
+        index = self.order.index
+        counts = [0] * len(index)
+        for permu in self.fixed:
+            for cell_, n in permu.iteritems():
+                counts[index[cell_]] = n
+        return Permutation.from_counts(self.order, tuple(counts))
+
+    def enumerate(self, token=None):
         """recursively generate all possible mine configurations for the ruleset"""
         if self.is_complete():
+            if self.stats is not None:
+                self.stats.count('configurations')
             yield self.mine_config()
         else:
+            if token is not None:
+                token.check()
             for next_state in self:
-                for mineconfig in next_state.enumerate():
+                for mineconfig in next_state.enumerate(token):
                     yield mineconfig
 
 class FrontTally(object):
     """tabulation of per-cell mine frequencies"""
 
+    # # of configurations to buffer before summing them into the sub-tallies
+    BATCH_SIZE = 1024
+
     def __init__(self, data=None):
         # mapping: # of mines in configuration -> sub-tally of configurations with that # of mines
-        self.subtallies = collections.defaultdict(FrontSubtally) if data is None else data
+        self.subtallies = {} if data is None else data
 
-    def tally(self, front):
+    def tally(self, front, token=None):
         """tally all possible configurations for a front (ruleset)
 
         note that the tallies for different total # of mines must be
         maintained separately, as these will be given different statistical
         weights later on
+
+        token -- optional CancelToken, checked (and informed of progress) as
+            enumeration proceeds
         """
 
-        for config in front.enumerate():
-            self.subtallies[config.k()].add(config)
+        self.accumulate(front.enumerate(token), token=token)
 
         if not self.subtallies:
             # front has no possible configurations
@@ -839,6 +1710,34 @@ class FrontTally(object):
 
         self.finalize()
 
+    def accumulate(self, configs, weights=None, token=None):
+        """add a stream of configurations (Permutations, all over the same
+        CellOrder) to the un-finalized sub-tallies, in batches
+
+        weights -- optional stream of per-configuration weights to use in
+            place of multiplicity
+        token -- optional CancelToken to report progress to after each batch
+        """
+        entries = itertools.izip(configs, weights if weights is not None else itertools.repeat(1))
+        num_configs = 0
+        while True:
+            batch = list(itertools.islice(entries, self.BATCH_SIZE))
+            if not batch:
+                break
+            num_configs += len(batch)
+            if token is not None:
+                token.checkpoint('enumerate', num_configs)
+            order = batch[0][0].order
+            by_num_mines = collections.defaultdict(lambda: ([], []))
+            for config, weight in batch:
+                counts, batch_weights = by_num_mines[config.k()]
+                counts.append(config.counts)
+                batch_weights.append(weight)
+            for num_mines, (counts, batch_weights) in by_num_mines.iteritems():
+                if num_mines not in self.subtallies:
+                    self.subtallies[num_mines] = FrontSubtally(order)
+                self.subtallies[num_mines].add_batch(counts, batch_weights if weights is not None else None)
+
     def finalize(self):
         """finalize all sub-tallies (convert running totals to
         probabilities/expected values)"""
@@ -864,10 +1763,13 @@ class FrontTally(object):
     def normalize(self):
         """normalize sub-tally totals into relative weights such that
         sub-totals remain proportional to each other, and the grand total
-        across all sub-tallies is 1."""
+        across all sub-tallies is 1.
+
+        totals may be in any numeric representation (see NUMERIC_BACKENDS);
+        normalized weights are always plain floats"""
         total = sum(subtally.total for subtally in self.subtallies.values())
         for subtally in self.subtallies.values():
-            subtally.total /= float(total)
+            subtally.total = float(operator.truediv(subtally.total, total))
             subtally.normalized = True
             
     def collapse(self):
@@ -878,6 +1780,12 @@ class FrontTally(object):
         for entry in collapsed.iteritems():
             yield entry
 
+    def copy(self):
+        """return a copy of this *finalized* tally whose weights can be
+        adjusted independently of the original"""
+        return FrontTally(dict((num_mines, FrontSubtally.from_values(subtally.total, subtally.cells_, subtally.values))
+                               for num_mines, subtally in self))
+
     def scale_weights(self, scalefunc):
         """scale each sub-tally's weight/total according to 'scalefunc'
 
@@ -886,13 +1794,19 @@ class FrontTally(object):
         for num_mines, subtally in self:
             subtally.total *= scalefunc(num_mines)
 
+    def convert_weights(self, numeric):
+        """convert each sub-tally's weight/total to the representation of
+        numeric backend 'numeric'"""
+        for num_mines, subtally in self:
+            subtally.total = numeric.number(subtally.total)
+
     def update_weights(self, weights):
         """update each sub-tally's weight/total
 
         weights -- mapping: num_mines -> new weight of the sub-tally for 'num_mines'
         """
         for num_mines, subtally in self:
-            subtally.total = weights.get(num_mines, 0.)
+            subtally.total = weights.get(num_mines, 0)
 
     @staticmethod
     def from_rule(rule):
@@ -916,38 +1830,69 @@ class FrontTally(object):
         return str(dict(self.subtallies))
 
 class FrontSubtally(object):
-    """sub-tabulation of per-cell mine frequencies"""
+    """sub-tabulation of per-cell mine frequencies
 
-    def __init__(self):
+    per-cell figures are kept in an array, matching a fixed order of the
+    front's supercells (cells_)
+    """
+
+    def __init__(self, order=None):
+        """order -- CellOrder of the configurations to be added"""
         # 'weight' of this sub-tally among the others in the FrontTally. initially
         # will be a raw count of the configurations in this sub-tally, but later
         # will be skewed due to weighting and normalizing factors
         self.total = 0
-        # per-cell mine counts (pre-finalizing) / mine prevalence (post-finalizing)
-        # mapping: supercell -> total # of mines in cell summed across all configurations (pre-finalize)
-        #                    -> expected # of mines in cell (post-finalize)
-        self.tally = collections.defaultdict(lambda: 0)
+        self.order = order
+        self.cells_ = order.cells_ if order is not None else ()
+        # per-cell mine counts (pre-finalizing) / mine prevalence (post-finalizing), indexed like cells_:
+        #   total # of mines in cell summed across all configurations (pre-finalize)
+        #   expected # of mines in cell (post-finalize)
+        self.values = [0] * len(self.cells_)
 
         self.finalized = False
         self.normalized = False
 
+    @property
+    def tally(self):
+        """per-cell figures as a mapping: supercell -> value"""
+        return dict(itertools.izip(self.cells_, self.values))
+
     def add(self, config):
         """add a configuration to the tally"""
-        mult = config.multiplicity() # weight by multiplicity
-        self.total += mult
-        for cell_, n in config.mapping.iteritems():
-            self.tally[cell_] += n * mult
+        self.add_batch([config.counts])
+
+    def add_batch(self, batch, weights=None):
+        """add several configurations to the tally, given as their mine counts
+        over this sub-tally's order
+
+        weights -- optional list of per-configuration weights to use in place
+            of multiplicity
+        """
+        columns = zip(*batch)
+        if weights is not None:
+            mults = list(weights)
+        else:
+            # weight by multiplicity
+            mults = [1] * len(batch)
+            for table, column in itertools.izip(self.order.multiplicities(), columns):
+                if table is not None:
+                    mults = map(operator.mul, mults, map(table.__getitem__, column))
+        self.total += sum(mults)
+        # singleton cells hold 0 or 1 mines, so their sums need no multiplying
+        self.values = [n + (sum(map(operator.mul, column, mults)) if table is not None else sum(itertools.compress(mults, column)))
+                       for n, table, column in itertools.izip(self.values, self.order.multiplicities(), columns)]
 
     def finalize(self):
         """after all configurations have been summed, compute relative
         prevalence from totals"""
-        self.tally = dict((cell_, n / float(self.total)) for cell_, n in self.tally.iteritems())
+        # true division of longs stays accurate even past the range of a float
+        self.values = [operator.truediv(n, self.total) for n in self.values]
         self.finalized = True
 
     def collapse(self):
         """helper function for FrontTally.collapse(); emit all cell expected
         mine values weighted by this sub-tally's weight"""
-        for cell_, expected_mines in self.tally.iteritems():
+        for cell_, expected_mines in itertools.izip(self.cells_, self.values):
             yield (cell_, self.total * expected_mines)
 
     @staticmethod
@@ -955,45 +1900,950 @@ class FrontSubtally(object):
         """build a sub-tally manually
 
         tally data must already be finalized"""
+        return FrontSubtally.from_values(total, tally.keys(), tally.values())
+
+    @staticmethod
+    def from_values(total, cells_, values):
+        """build a sub-tally manually from finalized per-cell values, indexed
+        like cells_"""
         o = FrontSubtally()
         o.total = total
-        o.tally = tally
+        o.cells_ = tuple(cells_)
+        o.values = list(values)
         o.finalized = True
         return o
 
     def __repr__(self):
-        return str((self.total, dict(self.tally)))
+        return str((self.total, self.tally))
+
+# tallies of recently-seen front shapes, shared by all solves in this process;
+# set to None to disable, or to a FrontStore (see open_front_store()) to also
+# share them with other processes, and keep them across restarts
+front_shape_cache = LRUCache(1024)
+
+class FrontStore(object):
+    """a mapping: FrontShape key -> canonical tally (see
+    FrontShape.canonical_tally()), kept in an sqlite database on disk, in
+    front of which sits an in-memory LRUCache
+
+    any number of processes may use the same database at once, reading
+    concurrently (it is in write-ahead-log mode), and it outlives them all.
+    entries are never evicted from disk; clear() empties the store
+
+    the database is only opened on first use. should it fail (it can't be
+    opened, is locked for too long, etc.), the error is logged and the store
+    carries on as just the in-memory cache: a lookup is a miss, and a tally
+    is kept in memory only
+    """
+
+    # bump whenever the keys or the pickled tallies change form; the tallies
+    # of other versions are then left alone, in their own tables
+    FORMAT_VERSION = 1
 
-def enumerate_front(front):
+    def __init__(self, path, memory_size=1024):
+        """
+        path -- file of the database; created if need be
+        memory_size -- max # of tallies to also keep in memory
+        """
+        self.path = path
+        self.table = 'front_tallies_v%d' % self.FORMAT_VERSION
+        self.memory = LRUCache(memory_size)
+        # connections can be shared neither across threads nor across a fork
+        self.local = threading.local()
+
+    def db(self):
+        """return the connection for the current thread and process, or None
+        if the database could not be opened"""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.pid = os.getpid()
+            self.local.db = None
+            try:
+                db = sqlite3.connect(self.path, timeout=30., isolation_level=None)
+                db.execute('PRAGMA journal_mode=WAL')
+                # a tally lost in a crash is merely enumerated again
+                db.execute('PRAGMA synchronous=NORMAL')
+                db.execute('CREATE TABLE IF NOT EXISTS %s (shape BLOB PRIMARY KEY, tally BLOB NOT NULL)' % self.table)
+                self.local.db = db
+            except sqlite3.Error, e:
+                logging.warning('front store %s unavailable; using memory only: %s' % (self.path, e))
+        return self.local.db
+
+    def execute(self, sql, args=()):
+        """run a statement against the database; return its cursor, or None
+        on error"""
+        db = self.db()
+        if db is None:
+            return None
+        try:
+            return db.execute(sql % self.table, args)
+        except sqlite3.Error, e:
+            logging.warning('front store %s: %s' % (self.path, e))
+            return None
+
+    @staticmethod
+    def digest(key):
+        return sqlite3.Binary(hashlib.sha1(repr(key)).digest())
+
+    def get(self, key, default=None):
+        tally = self.memory.get(key)
+        if tally is None:
+            rows = self.execute('SELECT tally FROM %s WHERE shape = ?', (self.digest(key),))
+            row = rows.fetchone() if rows is not None else None
+            if row is None:
+                return default
+            tally = cPickle.loads(str(row[0]))
+            self.memory[key] = tally
+        return tally
+
+    def __getitem__(self, key):
+        tally = self.get(key)
+        if tally is None:
+            raise KeyError(key)
+        return tally
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, tally):
+        self.memory[key] = tally
+        self.execute('INSERT OR REPLACE INTO %s VALUES (?, ?)',
+                     (self.digest(key), sqlite3.Binary(cPickle.dumps(tally, cPickle.HIGHEST_PROTOCOL))))
+
+    def __len__(self):
+        """# of tallies on disk (in memory, if the database is unavailable)"""
+        rows = self.execute('SELECT COUNT(*) FROM %s')
+        return rows.fetchone()[0] if rows is not None else len(self.memory)
+
+    def clear(self):
+        self.memory.clear()
+        self.execute('DELETE FROM %s')
+
+    def clear_memory(self):
+        """empty only the in-memory cache, leaving the database (which other
+        processes may be sharing) alone"""
+        self.memory.clear()
+
+def open_front_store(path, memory_size=1024):
+    """make the front shape cache of this process (and of any processes it
+    forks from here on) persistent, backed by the database at 'path'; see
+    FrontStore"""
+    global front_shape_cache
+    front_shape_cache = FrontStore(path, memory_size)
+    return front_shape_cache
+
+# lets processes that are not forked from one that called open_front_store()
+# (e.g., web workers) share a store, too
+if os.environ.get('MINESWEEPR_FRONT_STORE'):
+    open_front_store(os.environ['MINESWEEPR_FRONT_STORE'])
+
+def enumerate_front(front, engine='enumerate', token=None):
     """enumerate and tabulate all mine configurations for the given front
 
     return a tally where: sub-totals are split out by total # of mines in
     configuration, and each sub-tally contains: a total count of matching
     configurations, and expected # of mines in each cell
+
+    engine -- key of TALLY_ENGINES to tally with
+    token -- optional CancelToken (such as a Deadline) to check as tallying
+        proceeds
+
+    tallies are memoized by the shape of the front (see FrontShape), so a
+    front that is merely a relabeling of one seen recently is not enumerated
+    again
     """
+    tally_engine = TALLY_ENGINES[engine]
+    if front_shape_cache is None:
+        return tally_engine(front, token)
+
+    shape = FrontShape(front)
+    canonical_tally = front_shape_cache.get(shape.key)
+    if canonical_tally is None:
+        canonical_tally = shape.canonical_tally(tally_engine(front, token))
+        front_shape_cache[shape.key] = canonical_tally
+    return shape.tally(canonical_tally)
+
+def _enumerate_front(front, token=None):
+    """uncached implementation of enumerate_front()"""
     tally = FrontTally()
-    tally.tally(front)
+    tally.tally(front, token)
     return tally
 
-def cell_probabilities(tallies, mine_prevalence, all_cells):
+def count_front(front, token=None):
+    """tally a front without enumerating its configurations, by variable
+    elimination over the supercells of the front
+
+    each rule becomes an indicator factor over its supercells (1 for each of
+    its remaining permutations) and each supercell a factor weighting its # of
+    mines by multiplicity. factor values are kept as polynomials in the # of
+    mines (see MineCountPoly), so the result has the same per-mine-count
+    totals and expectations as enumeration. cost is exponential only in the
+    width of the elimination order, not in the # of configurations
+    """
+    factors = []
+    for rule, permu_set in front.permu_map.iteritems():
+        scope = tuple(rule.cells_)
+        project = Projector(scope)
+        factors.append(Factor(scope, dict((project(p), MineCountPoly.ONE) for p in permu_set)))
+    for cell_, counts in cell_domains(front).iteritems():
+        factors.append(Factor((cell_,), dict(((n,), MineCountPoly.for_cell(cell_, n)) for n in counts)))
+
+    for cell_ in elimination_order(front):
+        if token is not None:
+            token.check()
+        related = [f for f in factors if cell_ in f.scope]
+        factors = [f for f in factors if cell_ not in f.scope]
+        factors.append(reduce(Factor.join, related).sum_out(cell_))
+
+    result = reduce(Factor.join, factors).table.get(())
+    if result is None:
+        raise InconsistencyError('mine front has no possible configurations')
+    return result.tally(front.cells_)
+
+def cell_domains(front):
+    """return mapping: supercell -> set of possible # of mines therein, as
+    allowed by every rule of the front"""
+    domains = {}
+    for rule, permu_set in front.permu_map.iteritems():
+        scope = tuple(rule.cells_)
+        project = Projector(scope)
+        for i, cell_ in enumerate(scope):
+            counts = set(project(p)[i] for p in permu_set)
+            domains[cell_] = domains[cell_] & counts if cell_ in domains else counts
+    return domains
+
+def elimination_order(front):
+    """order the supercells of a front for variable elimination, greedily
+    picking the supercell with the fewest neighbors (supercells sharing a
+    rule) that haven't been eliminated yet"""
+    return [cell_ for cell_, neighbors in elimination_steps(front)]
+
+def elimination_steps(front):
+    """helper for elimination_order(); generate (supercell, its neighbors
+    not yet eliminated) in order of elimination"""
+    neighbors = collections.defaultdict(set)
+    for rule in front.rules:
+        for cell_ in rule.cells_:
+            neighbors[cell_] |= rule.cells_
+    for cell_ in neighbors:
+        neighbors[cell_].discard(cell_)
+
+    while neighbors:
+        cell_ = min(neighbors, key=lambda c: len(neighbors[c]))
+        # eliminating a supercell connects all its neighbors to each other
+        for neighbor in neighbors[cell_]:
+            neighbors[neighbor] |= neighbors[cell_]
+            neighbors[neighbor].discard(neighbor)
+            neighbors[neighbor].discard(cell_)
+        yield cell_, neighbors.pop(cell_)
+
+class Factor(object):
+    """a function over assignments of mine counts to a set of supercells,
+    for count_front()
+
+    scope -- tuple of supercells
+    table -- mapping: tuple of # mines per supercell in scope -> MineCountPoly;
+        assignments not present are impossible
+    """
+
+    def __init__(self, scope, table):
+        self.scope = scope
+        self.table = table
+
+    def join(self, other):
+        """return the product of this factor and 'other', over the union of
+        their scopes"""
+        common = [i for i, cell_ in enumerate(other.scope) if cell_ in self.scope]
+        extra = [i for i, cell_ in enumerate(other.scope) if cell_ not in self.scope]
+        own_common = [self.scope.index(other.scope[i]) for i in common]
+
+        # index the other factor by its assignment of the common supercells
+        index = map_reduce(other.table.iteritems(),
+                           lambda (assign, value): [(tuple(assign[i] for i in common),
+                                                     (tuple(assign[i] for i in extra), value))])
+        table = {}
+        for assign, value in self.table.iteritems():
+            for extra_assign, other_value in index.get(tuple(assign[i] for i in own_common), []):
+                table[assign + extra_assign] = value * other_value
+        return Factor(self.scope + tuple(other.scope[i] for i in extra), table)
+
+    def sum_out(self, cell_):
+        """return this factor with 'cell_' marginalized out"""
+        i = self.scope.index(cell_)
+        table = {}
+        for assign, value in self.table.iteritems():
+            key = assign[:i] + assign[i + 1:]
+            table[key] = table[key] + value if key in table else value
+        return Factor(self.scope[:i] + self.scope[i + 1:], table)
+
+class MineCountPoly(object):
+    """value type for count_front(): the total weight (# of configurations
+    accounting for multiplicity) of a set of partial configurations, and the
+    weighted sum of mines in each supercell, each split out by total # of mines
+
+    weights -- mapping: # mines -> weight
+    cell_weights -- mapping: supercell -> # mines -> weighted sum of mines in
+        supercell
+    """
+
+    def __init__(self, weights, cell_weights):
+        self.weights = weights
+        self.cell_weights = cell_weights
+
+    @staticmethod
+    def for_cell(cell_, n):
+        """value of 'n' mines in the given supercell"""
+        mult = choose(len(cell_), n)
+        return MineCountPoly({n: mult}, {cell_: {n: n * mult}})
+
+    @staticmethod
+    def _mul(a, b):
+        """multiply two polynomials"""
+        if len(a) > len(b):
+            a, b = b, a
+        if len(a) == 1:
+            # monomial; common when joining with a supercell's factor
+            (i, x), = a.items()
+            return dict((i + j, x * y) for j, y in b.iteritems())
+
+        product = collections.defaultdict(int)
+        for i, x in a.iteritems():
+            for j, y in b.iteritems():
+                product[i + j] += x * y
+        return product
+
+    @staticmethod
+    def _add(a, b):
+        """add two polynomials"""
+        total = dict(a)
+        for i, y in b.iteritems():
+            total[i] = total.get(i, 0) + y
+        return total
+
+    def __mul__(self, other):
+        if self is MineCountPoly.ONE:
+            return other
+        elif other is MineCountPoly.ONE:
+            return self
+
+        # product rule: the expectations of one side are scaled by the weights of the other
+        cell_weights = dict((cell_, self._mul(w, other.weights)) for cell_, w in self.cell_weights.iteritems())
+        for cell_, w in other.cell_weights.iteritems():
+            cell_weights[cell_] = self._mul(self.weights, w)
+        return MineCountPoly(self._mul(self.weights, other.weights), cell_weights)
+
+    def __add__(self, other):
+        cell_weights = dict(self.cell_weights)
+        for cell_, w in other.cell_weights.iteritems():
+            cell_weights[cell_] = self._add(cell_weights[cell_], w) if cell_ in cell_weights else w
+        return MineCountPoly(self._add(self.weights, other.weights), cell_weights)
+
+    def tally(self, cells_):
+        """convert to a finalized FrontTally over the given supercells"""
+        return FrontTally(dict((num_mines, FrontSubtally.from_values(total, cells_,
+                    [operator.truediv(self.cell_weights.get(cell_, {}).get(num_mines, 0), total) for cell_ in cells_]))
+                for num_mines, total in self.weights.iteritems() if total))
+
+MineCountPoly.ONE = MineCountPoly({0: 1}, {})
+
+def enumeration_cost(front):
+    """estimate the work of tallying a front by enumeration: an upper bound
+    on the # of nodes in the search tree of EnumerationState
+
+    rules are fixed one at a time, each time picking the rule with the fewest
+    permutations left open. once some of a rule's cells are fixed, at most
+    its largest group of permutations that agree on those cells remain, so
+    the product of these along the order bounds the # of partial
+    configurations at each depth. much tighter than complexity(), which
+    ignores overlap entirely
+    """
+    fixed_cells = set()
+    # mapping: rule not yet fixed -> most permutations it could have open
+    branching = dict((rule, len(permu_set.permus)) for rule, permu_set in front.permu_map.iteritems())
+    cost = 0
+    num_partial = 1
+    while branching:
+        rule = min(branching, key=branching.get)
+        num_partial *= branching.pop(rule)
+        cost += num_partial
+        fixed_cells |= rule.cells_
+        for rule_ov in front.cell_rules_map.overlapping_rules(rule):
+            if rule_ov in branching:
+                project = Projector([cell_ for cell_ in rule_ov.cells_ if cell_ in fixed_cells])
+                branching[rule_ov] = max(map_reduce(front.permu_map[rule_ov], lambda p: [(project(p),)], len).values())
+    return cost
+
+def elimination_cost(front):
+    """estimate the work of tallying a front by count_front(): the total size
+    of the factors built, each eliminated supercell's factor being bounded by
+    the product of the # of possible mine counts of it and its neighbors"""
+    domains = cell_domains(front)
+    return sum(product(len(domains[c]) for c in neighbors | set([cell_]))
+               for cell_, neighbors in elimination_steps(front))
+
+# estimators of the cost of each tally engine, in common units: nodes of the
+# enumeration search tree, a few microseconds each
+ENGINE_COSTS = {
+    'enumerate': enumeration_cost,
+    'count': lambda front: COUNT_COST_SCALE * elimination_cost(front),
+}
+# cost of a unit of elimination_cost(), relative to enumeration_cost()
+COUNT_COST_SCALE = 5.
+
+def front_cost(front, engine='auto'):
+    """estimate the cost (see ENGINE_COSTS) to tally a front with the given
+    engine; for 'auto', with the cheapest engine"""
+    if engine == 'auto':
+        return min(estimate(front) for estimate in ENGINE_COSTS.values())
+    return ENGINE_COSTS[engine](front)
+
+def choose_engine(front):
+    """return the engine expected to tally the front the cheapest"""
+    return min(ENGINE_COSTS, key=lambda engine: ENGINE_COSTS[engine](front))
+
+def auto_front(front, token=None):
+    """tally a front with whichever engine is expected to be cheapest"""
+    return TALLY_ENGINES[choose_engine(front)](front, token)
+
+# mapping: engine name -> function: (front, optional Deadline) -> FrontTally
+TALLY_ENGINES = {
+    'enumerate': _enumerate_front,
+    'count': count_front,
+    'auto': auto_front,
+}
+
+class FrontShape(object):
+    """a canonical description of a front that is independent of the
+    identities of its cells: the size of each supercell, which supercells each
+    rule covers, and the permutations remaining for each rule
+
+    supercells are put into a canonical order via color refinement, and fronts
+    that are relabelings of each other get the same key. the key fully
+    describes the front, so equal keys always imply equal tallies (modulo the
+    relabeling); an imperfect canonical order only costs cache hits
+    """
+
+    # max # of candidate orderings to consider when breaking ties between
+    # supercells that refinement cannot tell apart (i.e., symmetric fronts)
+    MAX_ORDERINGS = 24
+
+    def __init__(self, front):
+        cells_ = list(front.cells_)
+        index = dict((cell_, i) for i, cell_ in enumerate(cells_))
+        self.sizes = [len(cell_) for cell_ in cells_]
+
+        # each rule as (indexes of its supercells, list of permutations as a
+        # tuple of mine counts aligned with those indexes)
+        self.rules = []
+        # for each supercell, list of (rule #, position of supercell within rule)
+        self.memberships = [[] for cell_ in cells_]
+        for rule, permu_set in front.permu_map.iteritems():
+            members = [index[cell_] for cell_ in rule.cells_]
+            permus = [tuple(p[cells_[i]] for i in members) for p in permu_set]
+            for j, i in enumerate(members):
+                self.memberships[i].append((len(self.rules), j))
+            self.rules.append((members, permus))
+        # per (rule #, position): sorted mine counts that supercell takes on
+        # across the rule's permutations
+        self.profiles = [[tuple(sorted(p[j] for p in permus)) for j in xrange(len(members))]
+                         for members, permus in self.rules]
+
+        initial = self._relabel([(size, tuple(sorted((len(self.rules[r][0]), len(self.rules[r][1]),
+                                                      self.profiles[r][j]) for r, j in memberships)))
+                                 for size, memberships in zip(self.sizes, self.memberships)])
+        self.key, order = min(self._orderings(initial, [self.MAX_ORDERINGS]))
+        self.cells_ = [cells_[i] for i in order]
+
+    @staticmethod
+    def _relabel(values):
+        """replace each value with its rank among the distinct values"""
+        ranks = dict((v, n) for n, v in enumerate(sorted(set(values))))
+        return [ranks[v] for v in values]
+
+    def _refine(self, colors):
+        """refine the supercell coloring until each color class is stable
+        w.r.t. the colors of the rules its supercells appear in"""
+        num_colors = len(set(colors))
+        while True:
+            rule_colors = [tuple(sorted((colors[i], self.profiles[r][j]) for j, i in enumerate(members)))
+                           for r, (members, permus) in enumerate(self.rules)]
+            colors = self._relabel([(colors[i], tuple(sorted((rule_colors[r], self.profiles[r][j]) for r, j in memberships)))
+                                    for i, memberships in enumerate(self.memberships)])
+            if len(set(colors)) == num_colors:
+                return colors
+            num_colors = len(set(colors))
+
+    def _orderings(self, colors, budget):
+        """generate (key, supercell order) for candidate canonical orderings,
+        individualizing one supercell at a time from the first ambiguous color
+        class
+
+        budget -- single-element list holding the # of orderings left to emit
+        """
+        colors = self._refine(colors)
+        classes = map_reduce(enumerate(colors), lambda (i, color): [(color, i)])
+        ambiguous = [color for color, members in classes.iteritems() if len(members) > 1]
+        if not ambiguous:
+            budget[0] -= 1
+            order = sorted(xrange(len(colors)), key=lambda i: colors[i])
+            yield (self._key(order), order)
+            return
+
+        for i in classes[min(ambiguous)]:
+            if budget[0] <= 0:
+                return
+            for ordering in self._orderings([2 * c + (0 if k == i else 1) for k, c in enumerate(colors)], budget):
+                yield ordering
+
+    def _key(self, order):
+        """build the hashable description of the front for the given supercell
+        order"""
+        position = dict((i, n) for n, i in enumerate(order))
+        def rule_key((members, permus)):
+            cols = sorted(xrange(len(members)), key=lambda j: position[members[j]])
+            return (tuple(position[members[j]] for j in cols),
+                    tuple(sorted(tuple(p[j] for j in cols) for p in permus)))
+        return (tuple(self.sizes[i] for i in order), tuple(sorted(rule_key(rule) for rule in self.rules)))
+
+    def canonical_tally(self, tally):
+        """convert a finalized tally for this front into a form keyed by
+        canonical supercell order: mapping of # mines -> (total, tuple of
+        expected mines per supercell)"""
+        return dict((num_mines, (subtally.total, tuple(subtally.tally.get(cell_, 0.) for cell_ in self.cells_)))
+                    for num_mines, subtally in tally)
+
+    def tally(self, canonical_tally):
+        """inverse of canonical_tally(); map a canonical tally back onto this
+        front's supercells"""
+        return FrontTally(dict((num_mines, FrontSubtally.from_values(total, self.cells_, expected))
+                               for num_mines, (total, expected) in canonical_tally.iteritems()))
+
+def tally_front(front, front_cache=None, engine='enumerate', token=None):
+    """tally the given front, consulting 'front_cache' (if provided) for a
+    prior tally of an identical front
+
+    always returns a fresh tally, as tallies are modified in place during the
+    weighting phase
+    """
+    if front_cache is None:
+        return enumerate_front(front, engine, token)
+
+    key = front.fingerprint()
+    tally = front_cache.get(key)
+    if tally is None:
+        tally = enumerate_front(front, engine, token)
+        front_cache[key] = tally
+    return tally.copy()
+
+# fronts less complex than this (see PermutedRuleset.complexity()) are cheaper
+# to tally in-process than to ship to a worker
+PARALLEL_MIN_COMPLEXITY = 1000
+
+# fronts at least this complex are tallied by enumeration split across several
+# workers (see EnumerationState.split())
+SPLIT_MIN_COMPLEXITY = 100000
+# when splitting a front, aim for this many subproblems per worker so that
+# workers stay busy despite uneven subproblem sizes
+SPLIT_TASKS_PER_WORKER = 4
+
+def executor_workers(executor):
+    """return the # of workers of a process pool: its 'processes' (or the
+    private attribute in which a multiprocessing.Pool keeps that), else, if
+    it can't be told, the # of cpus"""
+    for attr in ('processes', '_processes'):
+        workers = getattr(executor, attr, None)
+        if isinstance(workers, int) and workers > 0:
+            return workers
+    return multiprocessing.cpu_count()
+
+def tally_fronts(fronts, front_cache=None, engine='enumerate', executor=None, token=None, stats=None):
+    """tally a set of fronts; see tally_front()
+
+    returns a mapping: front -> tally
+
+    executor -- if provided, sufficiently complex fronts not found in either
+        cache are tallied in parallel via executor.map(). they are sent in
+        compact, cell-name-independent form (as the key of their FrontShape),
+        most complex first, and come back as canonical tallies. the most
+        complex fronts are additionally split into independent subtrees of
+        their enumeration (SPLIT_TASKS_PER_WORKER per worker; see
+        executor_workers()), whose partial tallies are merged afterwards
+    token -- optional CancelToken to check as tallying proceeds. if it is a
+        Deadline, fronts not tallied by then map to None (any other
+        cancellation propagates as SolveCancelled). without an executor,
+        fronts are tallied simplest first, so that as many as possible finish
+    stats -- optional SolveStats in which to record each front
+    """
+    def tally_local(front):
+        start = time.time()
+        try:
+            return tally_front(front, front_cache, engine, token)
+        except DeadlineExceeded:
+            return None
+        finally:
+            if stats is not None:
+                stats.add_front(front, time.time() - start)
+
+    if executor is None:
+        if token is not None:
+            fronts = sorted(fronts, key=lambda f: f.complexity())
+        return dict((f, tally_local(f)) for f in fronts)
+
+    tallies = {}
+    remote = []
+    for front in fronts:
+        if front.complexity() < PARALLEL_MIN_COMPLEXITY or (front_cache is not None and front.fingerprint() in front_cache):
+            tallies[front] = tally_local(front)
+            continue
+        shape = FrontShape(front)
+        if front_shape_cache is not None and shape.key in front_shape_cache:
+            tallies[front] = tally_local(front)
+        else:
+            remote.append((front, shape))
+
+    # fronts that are relabelings of each other (as across the boards of
+    # solve_many()) need only be tallied once
+    remote = map_reduce(remote, lambda (front, shape): [(shape.key, (front, shape))]).values()
+
+    # list of (complexity, index into 'remote', task)
+    tasks = []
+    for i, group in enumerate(remote):
+        front, shape = group[0]
+        if engine == 'enumerate' and front.complexity() >= SPLIT_MIN_COMPLEXITY:
+            subtasks = split_shape(shape.key, SPLIT_TASKS_PER_WORKER * executor_workers(executor))
+            tasks.extend((front.complexity() / len(subtasks), i, task + (token,)) for task in subtasks)
+        else:
+            tasks.append((front.complexity(), i, ('shape', shape.key, engine, token)))
+    tasks.sort(key=lambda (complexity, i, task): complexity, reverse=True)
+
+    results = collections.defaultdict(list)
+    for (complexity, i, task), result in zip(tasks, executor.map(front_task, [task for c, i, task in tasks])):
+        results[i].append(result)
+
+    for i, group in enumerate(remote):
+        if stats is not None:
+            for front, shape in group:
+                stats.add_front(front)
+        if any(kind == 'timeout' for kind, result in results[i]):
+            tallies.update((front, None) for front, shape in group)
+            continue
+        kind, result = results[i][0]
+        canonical_tally = result if kind == 'tally' else merge_subtree_tallies(results[i])
+        if front_shape_cache is not None:
+            front_shape_cache[group[0][1].key] = canonical_tally
+        for front, shape in group:
+            tally = shape.tally(canonical_tally)
+            if front_cache is not None:
+                front_cache[front.fingerprint()] = tally
+                tally = tally.copy()
+            tallies[front] = tally
+    return tallies
+
+def front_task(task):
+    """run a unit of work in a worker process; one of:
+        ('shape', shape key, engine) -- tally a whole front; see tally_shape()
+        ('subtree', shape key, path) -- tally part of a front; see
+            tally_subtree()
+    optionally followed by a CancelToken (or None)
+    returns (kind of result, result), or ('timeout', None) if the token was a
+    Deadline that passed first"""
+    kind, shape_key, arg = task[:3]
+    token = task[3] if len(task) > 3 else None
+    try:
+        if kind == 'shape':
+            return ('tally', tally_shape((shape_key, arg), token))
+        else:
+            return ('partial', tally_subtree((shape_key, arg), token))
+    except DeadlineExceeded:
+        return ('timeout', None)
+
+def front_from_shape(shape_key):
+    """rebuild a stand-in front from the key of a FrontShape
+
+    returns (front, stand-in supercells in canonical order, rules in the
+    order of the key)"""
+    sizes, rules = shape_key
+    cells_ = [set_((i, j) for j in xrange(size)) for i, size in enumerate(sizes)]
+    permu_map = {}
+    ordered_rules = []
+    for members, permus in rules:
+        rule_cells = [cells_[i] for i in members]
+        permu_set = PermutationSet(set_(rule_cells), sum(permus[0]),
+                                   set(Permutation(zip(rule_cells, counts)) for counts in permus))
+        rule = permu_set.to_rule()
+        permu_map[rule] = permu_set
+        ordered_rules.append(rule)
+    return (PermutedRuleset(set(permu_map), permu_map), cells_, ordered_rules)
+
+def tally_shape((shape_key, engine), token=None):
+    """tally a front given only the key of its FrontShape, returning the
+    canonical tally; this is the unit of work sent to worker processes"""
+    front, cells_, rules = front_from_shape(shape_key)
+    tally = TALLY_ENGINES[engine](front, token)
+    return dict((num_mines, (subtally.total, tuple(subtally.tally.get(cell_, 0.) for cell_ in cells_)))
+                for num_mines, subtally in tally)
+
+def split_shape(shape_key, min_tasks):
+    """split the enumeration of a front (given as the key of its FrontShape)
+    into at least 'min_tasks' subtree tasks, where possible; see
+    EnumerationState.split()
+
+    each path choice is encoded as (index of rule in key, permutation as
+    mine counts in the order of the rule's supercells in the key)
+
+    raises InconsistencyError if every path turns out to be a dead end"""
+    front, cells_, rules = front_from_shape(shape_key)
+    rule_index = dict((rule, i) for i, rule in enumerate(rules))
+    members = [[cells_[i] for i in m] for m, permus in shape_key[1]]
+    def encode((rule, permu)):
+        i = rule_index[rule]
+        return (i, tuple(permu[cell_] for cell_ in members[i]))
+    subtrees = EnumerationState(front).split(min_tasks)
+    if not subtrees:
+        raise InconsistencyError('mine front has no possible configurations')
+    return [('subtree', shape_key, map(encode, path)) for path, state in subtrees]
+
+def tally_subtree((shape_key, path), token=None):
+    """enumerate the configurations of a front (given as the key of its
+    FrontShape) that follow from the choices in 'path' (see split_shape());
+    return the un-finalized sums: mapping # mines -> (total, tuple of summed
+    mines per supercell in canonical order)"""
+    front, cells_, rules = front_from_shape(shape_key)
+    members = [[cells_[i] for i in m] for m, permus in shape_key[1]]
+
+    tally = FrontTally()
+    try:
+        state = EnumerationState(front)
+        for i, counts in path:
+            state = state.propogate(rules[i], Permutation(zip(members[i], counts)))
+    except ValueError:
+        # dead end; cannot happen for paths produced by split_shape()
+        return {}
+    tally.accumulate(state.enumerate(token))
+    return dict((num_mines, (subtally.total, tuple(subtally.tally.get(cell_, 0) for cell_ in cells_)))
+                for num_mines, subtally in tally)
+
+def merge_subtree_tallies(results):
+    """combine the partial results of tally_subtree() into a canonical tally"""
+    merged = {}
+    for kind, partial in results:
+        for num_mines, (total, sums) in partial.iteritems():
+            if num_mines in merged:
+                merged_total, merged_sums = merged[num_mines]
+                merged[num_mines] = (merged_total + total, map(operator.add, merged_sums, sums))
+            else:
+                merged[num_mines] = (total, sums)
+    if not merged:
+        raise InconsistencyError('mine front has no possible configurations')
+    return dict((num_mines, (total, tuple(operator.truediv(n, total) for n in sums)))
+                for num_mines, (total, sums) in merged.iteritems())
+
+# default # of samples per front in approximate mode
+APPROXIMATE_BUDGET = 2000
+# # of independent batches the samples for a front are split into, for
+# estimating the error of an approximate solution
+APPROXIMATE_BATCHES = 10
+# two-sided 95% quantile of Student's t-distribution with
+# APPROXIMATE_BATCHES - 1 degrees of freedom
+APPROXIMATE_T_QUANTILE = 2.262
+# # of samples for the quick estimate of a front that ran past the deadline
+DEADLINE_FALLBACK_BUDGET = 200
+# time allowed for the quick estimates of all such fronts, in seconds
+DEADLINE_FALLBACK_TIME = .25
+
+def sample_front(front, num_samples, num_batches=APPROXIMATE_BATCHES, rand=random, token=None):
+    """estimate the tally of a front from random descents of its enumeration
+    tree (Knuth's estimator, with importance sampling), for fronts too
+    complex to enumerate
+
+    each descent repeatedly fixes the most constrained open rule to one of its
+    permutations until the configuration is complete. candidates that
+    directly contradict another open rule are skipped; among the rest, a
+    permutation is chosen with probability proportional to the multiplicity
+    of the cells it newly fixes, so that descents favor the configurations
+    that weigh the most. each configuration is weighted by its multiplicity
+    divided by the probability of the choices that led to it, which makes the
+    weighted per-mine-count totals and per-cell sums unbiased estimates of the
+    ones enumeration would produce (scaled by the # of samples, a constant
+    factor that weighting cancels out). descents that hit a conflict anyway
+    count as samples of weight 0
+
+    the samples are dealt round-robin into 'num_batches' independent batches;
+    returns a list of un-finalized FrontTallys, one per batch
+
+    token -- optional CancelToken, checked before each sample. if it is a
+        Deadline, sampling merely stops early once it passes (though not
+        before each batch has one sample, unless it passes before sampling
+        can even begin, in which case there are no samples at all)
+    """
+    try:
+        root = EnumerationState(front, token)
+    except DeadlineExceeded:
+        return [FrontTally() for i in xrange(num_batches)]
+    tables = dict(itertools.izip(root.order.cells_, root.order.multiplicities()))
+    def multiplicity(cells_counts):
+        return product(tables[cell_][n] for cell_, n in cells_counts if tables[cell_] is not None)
+
+    def descend():
+        """return a sampled configuration and its weight, or (None, 0) on a
+        dead end"""
+        state = root.clone()
+        # multiplicity / probability of the path taken. the probability of each
+        # choice is its multiplicity over the sum of candidate multiplicities, so
+        # only that sum, and the multiplicity of cells fixed by cascading, remain
+        weight = 1
+        fixed_permus = set()
+        fixed_cells = set()
+        while not state.is_complete():
+            rule = state.select_rule()
+            candidates = [permu for permu in state.free[rule]
+                          if all(not state.free[related_rule].isdisjoint(state.compatible_rule_index[(permu, related_rule)])
+                                 for related_rule in state.overlapping_rules(rule) if related_rule in state.free)]
+            if not candidates:
+                return None, 0
+            mults = [multiplicity((cell_, n) for cell_, n in permu.iteritems() if cell_ not in fixed_cells)
+                     for permu in candidates]
+            total = sum(mults)
+            pick = rand.randrange(total)
+            for permu, mult in itertools.izip(candidates, mults):
+                pick -= mult
+                if pick < 0:
+                    break
+            try:
+                state._propogate(rule, permu)
+            except ValueError:
+                # conflict detected; dead end
+                return None, 0
+
+            weight *= total
+            fixed_cells.update(cell_ for cell_, n in permu.iteritems())
+            for cascaded in state.fixed - fixed_permus - set([permu]):
+                new = [(cell_, n) for cell_, n in cascaded.iteritems() if cell_ not in fixed_cells]
+                weight *= multiplicity(new)
+                fixed_cells.update(cell_ for cell_, n in new)
+            fixed_permus = set(state.fixed)
+        return state.mine_config(), weight
+
+    batches = [[] for i in xrange(num_batches)]
+    for i in xrange(num_samples):
+        if token is not None:
+            try:
+                token.check()
+            except DeadlineExceeded:
+                if i >= num_batches:
+                    break
+        config, weight = descend()
+        if config is not None:
+            batches[i % num_batches].append((config, weight))
+
+    tallies = []
+    for samples in batches:
+        tally = FrontTally()
+        tally.accumulate((config for config, weight in samples), (weight for config, weight in samples))
+        tallies.append(tally)
+    return tallies
+
+def marginal_tally(front):
+    """a crude estimate of the tally of a front, for when there is no time to
+    sample it (or sampling finds nothing): each supercell's expected # of
+    mines is its mean across the permutations of the rules it is in, as if
+    those rules were independent, and the front's # of mines is taken to be
+    the (rounded) total of these. returns a finalized tally"""
+    cell_means = collections.defaultdict(list)
+    for rule, permu_set in front.permu_map.iteritems():
+        permus = list(permu_set)
+        for cell_ in rule.cells_:
+            cell_means[cell_].append(float(sum(p[cell_] for p in permus)) / len(permus))
+    cells_ = list(front.cells_)
+    expected = [sum(cell_means[cell_]) / len(cell_means[cell_]) for cell_ in cells_]
+    return FrontTally({int(round(sum(expected))): FrontSubtally.from_values(1, cells_, expected)})
+
+def merge_front_tallies(tallies):
+    """sum several un-finalized tallies of the same front into a new,
+    un-finalized tally"""
+    merged = FrontTally()
+    for tally in tallies:
+        for num_mines, subtally in tally:
+            if num_mines not in merged.subtallies:
+                merged.subtallies[num_mines] = FrontSubtally(subtally.order)
+            target = merged.subtallies[num_mines]
+            target.total += subtally.total
+            target.values = map(operator.add, target.values, subtally.values)
+    return merged
+
+def approximate_solution(tallies, samples, mine_prevalence, all_cells, other_tag, names, numeric, estimated=()):
+    """build a Solution with confidence intervals from the exact tallies of
+    some fronts and the sampled tallies of others
+
+    tallies -- set of finalized FrontTallys for the fronts tallied exactly
+    samples -- for each sampled front, its list of per-batch tallies (see
+        sample_front())
+    estimated -- the cells of the sampled fronts (see Solution)
+
+    the probabilities are estimated from all samples pooled together. the
+    error is estimated by also solving with each batch of samples on its own
+    (batch means): the interval is the pooled estimate +/- a t-quantile times
+    the standard error of the per-batch estimates
+    """
+    def probabilities(sampled_tallies):
+        sampled_tallies = list(sampled_tallies)
+        if any(not tally.subtallies for tally in sampled_tallies):
+            return None
+        for tally in sampled_tallies:
+            tally.finalize()
+        all_tallies = set(tally.copy() for tally in tallies) | set(sampled_tallies)
+        cell_probs = cell_probabilities(all_tallies, mine_prevalence, all_cells, numeric)
+        return dict(expand_cells(cell_probs, other_tag, names))
+
+    pooled = probabilities(merge_front_tallies(batches) for batches in samples)
+    if pooled is None:
+        raise InconsistencyError('no valid mine configurations found by sampling')
+
+    batch_solutions = []
+    for batch in zip(*samples):
+        try:
+            solution = probabilities(batch)
+        except (InconsistencyError, ZeroDivisionError):
+            # batch too small to have found the necessary configurations
+            solution = None
+        if solution is not None:
+            batch_solutions.append(solution)
+
+    intervals = {}
+    for cell, p in pooled.iteritems():
+        estimates = [solution.get(cell, 0.) for solution in batch_solutions]
+        if len(estimates) > 1:
+            mean = sum(estimates) / len(estimates)
+            variance = sum((e - mean)**2 for e in estimates) / (len(estimates) - 1)
+            error = APPROXIMATE_T_QUANTILE * (variance / len(estimates))**.5
+        else:
+            error = 1.
+        intervals[cell] = (max(p - error, 0.), min(p + error, 1.))
+    return Solution(pooled, intervals, estimated)
+
+def cell_probabilities(tallies, mine_prevalence, all_cells, numeric=NUMERIC_BACKENDS['log']):
     """generate the final expected values for all cells in all fronts
 
     tallies -- set of 'FrontTally's
     mine_prevalence -- description of # or frequency of mines in board
         (from solve())
     all_cells -- a set of all supercells from all rules
+    numeric -- numeric backend in which to do the weighting (see
+        NUMERIC_BACKENDS)
 
     generates a stream of tuples: (cell, # mines / cell) for all cells
     """
 
-    weight_subtallies(tallies, mine_prevalence, all_cells)
+    weight_subtallies(tallies, mine_prevalence, all_cells, numeric)
     # concatenate and emit the cell solutions from all fronts
     return itertools.chain(*(tally.collapse() for tally in tallies))
 
-def weight_subtallies(tallies, mine_prevalence, all_cells):
+def weight_subtallies(tallies, mine_prevalence, all_cells, numeric=NUMERIC_BACKENDS['log']):
     """analyze all FrontTallys as a whole and weight the likelihood of each
     sub-tally using probability analysis"""
 
+    for tally in tallies:
+        tally.convert_weights(numeric)
+
     # True: traditional minesweeper -- fixed total # of mines
     # False: fixed overall probability of mine; total # of mines varies per game
     discrete_mode = isinstance(mine_prevalence, MineCount)
@@ -1008,12 +2858,12 @@ def weight_subtallies(tallies, mine_prevalence, all_cells):
         num_static_mines = sum(tally.max_mines() for tally in (tallies - dyn_tallies))
         at_large_mines = mine_prevalence.total_mines - num_static_mines
 
-        tally_uncharted = combine_fronts(dyn_tallies, num_uncharted_cells, at_large_mines)
+        tally_uncharted = combine_fronts(dyn_tallies, num_uncharted_cells, at_large_mines, numeric)
     else:
-        tally_uncharted = weight_nondiscrete(dyn_tallies, mine_prevalence)
+        tally_uncharted = weight_nondiscrete(dyn_tallies, mine_prevalence, numeric)
     tallies.add(tally_uncharted)
 
-def weight_nondiscrete(dyn_tallies, mine_prevalence):
+def weight_nondiscrete(dyn_tallies, mine_prevalence, numeric=NUMERIC_BACKENDS['log']):
     """weight the relative likelihood of each sub-tally in a 'fixed mine
     probability / variable # of mines'-style game
 
@@ -1021,7 +2871,7 @@ def weight_nondiscrete(dyn_tallies, mine_prevalence):
     the likelihoods for any other front
     """
     for tally in dyn_tallies:
-        relative_likelihood = lambda num_mines: nondiscrete_relative_likelihood(mine_prevalence, num_mines, tally.min_mines())
+        relative_likelihood = lambda num_mines: nondiscrete_relative_likelihood(mine_prevalence, num_mines, tally.min_mines(), numeric)
         tally.scale_weights(relative_likelihood)
 
     # regurgitate the fixed mine probability as the p for 'other' cells. kind of
@@ -1049,176 +2899,115 @@ def check_count_consistency(tallies, mine_prevalence, all_cells):
 
     return num_uncharted_cells
 
-def combine_fronts(tallies, num_uncharted_cells, at_large_mines):
+def combine_fronts(tallies, num_uncharted_cells, at_large_mines, numeric=NUMERIC_BACKENDS['log']):
     """assign relative weights to all sub-tallies in all fronts. because the
     total # of mines is fixed, we must do a combinatorial analysis to
     compute the likelihood of each front containing each possible # of mines.
     in the process, compute the mine count likelihood for the 'other' cells,
     not a part of any front, and return a meta-front encapsulating them.
+
+    each front's totals per # of mines form a MineCountVector, and the totals
+    for any group of fronts are the convolution of their vectors. the weight
+    of a front having m mines is its own total for m times the total for all
+    other fronts combined having the remaining at_large_mines - m mines. the
+    'all other fronts' vectors are assembled from running prefix and suffix
+    convolutions, each pruned to the mine counts that can still add up to
+    at_large_mines.
     """
 
     min_tallied_mines, max_tallied_mines = possible_mine_limits(tallies)
     min_other_mines = max(at_large_mines - max_tallied_mines, 0)
     # technically, min_tallied_mines known to be <= at_large_mines due to check_count_consistency()
     max_other_mines = min(max(at_large_mines - min_tallied_mines, 0), num_uncharted_cells)
-    def relative_likelihood(num_free_mines):
-        return discrete_relative_likelihood(num_uncharted_cells, num_free_mines, max_other_mines)
-
-    class FrontPerMineTotals(object):
-        """object that tracks, for a constituent front, how many configurations for each # of mines
-        in the front"""
-        def __init__(self, totals):
-            """totals: mapping of # mines -> # configurations"""
-            self.totals = totals
-
-        @staticmethod
-        def singleton(num_mines, total):
-            return FrontPerMineTotals({num_mines: total})
-
-        @property
-        def total_count(self):
-            """returns total # of configurations across all possible # of mines"""
-            return sum(self.totals.values())
-        
-        def multiply(self, n):
-            """multiply all the configuration counts by a fixed factor"""
-            return FrontPerMineTotals(dict((num_mines, n * count) for num_mines, count in self))
-
-        @staticmethod
-        def sum(front_totals):
-            """compute an aggregate sum of several mappings"""
-            return FrontPerMineTotals(map_reduce(front_totals, lambda ft: ft, sum))
-
-        def __iter__(self):
-            return self.totals.iteritems()
-        
-        def __repr__(self):
-            return str(self.totals)
-        
-    class AllFrontsPerMineTotals(object):
-        """object that tracks, for a given # of mines in the CombinedFront, the FrontPerMineTotals objects
-        corresponding to each constituent front"""
-        def __init__(self, front_totals):
-            """front_totals: a list of FrontPerMineTotals objects"""
-            self.front_totals = front_totals
-
-        @property
-        def total_count(self):
-            """total number of configurations for the given total # of mines in the combined front"""
-            if self.front_totals:
-                # the count should match for each constituent front
-                return self.front_totals[0].total_count
-            else:
-                # null case
-                return 1
-        
-        @staticmethod
-        def null():
-            return AllFrontsPerMineTotals([])
-        
-        @staticmethod
-        def singleton(num_mines, total):
-            return AllFrontsPerMineTotals([FrontPerMineTotals.singleton(num_mines, total)])
-        
-        def join_with(self, new):
-            """merge two AllFrontsPerMineTotals objects, joining into a single list and performing
-            necessary cross-multiplication"""
-            return AllFrontsPerMineTotals([f.multiply(new.total_count) for f in self.front_totals] +
-                                          [f.multiply(self.total_count) for f in new.front_totals])
-
-        @staticmethod
-        def sum(frontsets):
-            """sum a list of AllFrontsPerMineTotals objects on a per-constituent front basis"""
-            return AllFrontsPerMineTotals(map(FrontPerMineTotals.sum, zip(*frontsets)))
-
-        def __iter__(self):
-            return iter(self.front_totals)
-        
-        def __repr__(self):
-            return str((self.total_count, self.front_totals))
-                    
-    class CombinedFront(object):
-        """a representation of a combinatorial fusing of multiple fronts/tallies. essentially, track:
-        for total # of mines in the combined front -> for each constituent front -> count of total # of
-        configurations for each # of mines in the constituent front"""
-        
-        def __init__(self, total_mines_to_front_totals):
-            """total_mines_to_front_totals: a mapping of total # of mines in the combined front to
-            a AllFrontsPerMineTotals object"""
-            self.totals = total_mines_to_front_totals
-
-        @property
-        def min_max_mines(self):
-            """return (min, max) # of mines in the front"""
-            return tuple(f(self.totals.keys()) for f in (min, max))
-            
-        @staticmethod
-        def null():
-            """create an 'empty' combined front"""
-            return CombinedFront({0: AllFrontsPerMineTotals.null()})
-
-        @staticmethod
-        def from_counts_per_num_mines(mines_with_count):
-            """build a starter combined front using known counts for each # of mines"""
-            return CombinedFront(dict((num_mines, AllFrontsPerMineTotals.singleton(num_mines, total)) for num_mines, total in mines_with_count))
-        
-        @staticmethod
-        def from_tally(tally):
-            """build a starter combined front from a front tally"""
-            return CombinedFront.from_counts_per_num_mines((num_mines, subtally.total) for num_mines, subtally in tally)
-
-        @staticmethod
-        def for_other(min_mines, max_mines):
-            """build a starter combined front to represent the 'uncharted cells' region"""
-            return CombinedFront.from_counts_per_num_mines((n, relative_likelihood(n)) for n in xrange(min_mines, max_mines + 1))
-        
-        def join_with(self, new, min_remaining_mines, max_remaining_mines):
-            """combine two combined fronts. min/max remaining mines represent the total remaining mines available
-            in all fronts yet to be combined (excluding 'new'). this helps avoid computing combinations whose # mines
-            can never add up to the requisite # of board mines. this is also how we converge to a single total # of
-            mines upon combining all fronts"""
-            def cross_entry(((a_num_mines, a_fronts), (b_num_mines, b_fronts))):
-                combined_mines = a_num_mines + b_num_mines
-                min_mines_at_end = combined_mines + min_remaining_mines
-                max_mines_at_end = combined_mines + max_remaining_mines
-                if min_mines_at_end > at_large_mines or max_mines_at_end < at_large_mines:
-                    return None
-                return (combined_mines, a_fronts.join_with(b_fronts))
-            cross_entries = filter(None, map(cross_entry, itertools.product(self, new)))
-            new_totals = map_reduce(cross_entries, lambda kv: [kv], AllFrontsPerMineTotals.sum)
-            return CombinedFront(new_totals)
-
-        def collapse(self):
-            """once all fronts combined, unwrap objects and return the underlying counts corresponding to each front"""
-            assert len(self.totals) == 1
-            return [e.totals for e in self.totals.popitem()[1].front_totals]
-        
-        def __iter__(self):
-            return self.totals.iteritems()
-        
-        def __repr__(self):
-            return str(self.totals)
 
     tallies = list(tallies) # we need guaranteed iteration order
-    all_fronts = map(CombinedFront.from_tally, tallies) + [CombinedFront.for_other(min_other_mines, max_other_mines)]
-    min_remaining_mines, max_remaining_mines = map(sum, zip(*(f.min_max_mines for f in all_fronts)))
-    combined = CombinedFront.null()
-    for f in all_fronts:
-        # note that it's only safe to use min/max mines in this way before the front has been combined/modified
-        front_min, front_max = f.min_max_mines
-        min_remaining_mines -= front_min
-        max_remaining_mines -= front_max
-        combined = combined.join_with(f, min_remaining_mines, max_remaining_mines)
-    front_totals = combined.collapse()
+    vectors = [MineCountVector.from_totals(dict((num_mines, subtally.total) for num_mines, subtally in tally), numeric)
+               for tally in tallies]
+    vectors.append(MineCountVector(min_other_mines, [discrete_relative_likelihood(num_uncharted_cells, n, max_other_mines, numeric)
+                                                     for n in xrange(min_other_mines, max_other_mines + 1)]))
+
+    # mine count limits of vectors[:i] (leading) and vectors[i:] (trailing)
+    leading_limits = [(0, 0)]
+    for v in vectors:
+        leading_limits.append((leading_limits[-1][0] + v.min_mines, leading_limits[-1][1] + v.max_mines))
+    trailing_limits = [(0, 0)]
+    for v in reversed(vectors):
+        trailing_limits.insert(0, (trailing_limits[0][0] + v.min_mines, trailing_limits[0][1] + v.max_mines))
+
+    # prefixes[i]: combination of vectors[:i]; suffixes[i]: combination of vectors[i + 1:]
+    prefixes = [MineCountVector.unit(numeric)]
+    for i, v in enumerate(vectors[:-1]):
+        rest_min, rest_max = trailing_limits[i + 1]
+        prefixes.append(prefixes[-1].convolve(v, at_large_mines - rest_max, at_large_mines - rest_min, numeric))
+    suffixes = [MineCountVector.unit(numeric)]
+    for i in xrange(len(vectors) - 1, 0, -1):
+        rest_min, rest_max = leading_limits[i]
+        suffixes.insert(0, suffixes[0].convolve(vectors[i], at_large_mines - rest_max, at_large_mines - rest_min, numeric))
+
+    front_totals = []
+    for v, prefix, suffix in zip(vectors, prefixes, suffixes):
+        front_totals.append(dict((num_mines, total * prefix.convolve_at(suffix, at_large_mines - num_mines, numeric))
+                                 for num_mines, total in v
+                                 if prefix.can_combine_to(suffix, at_large_mines - num_mines)))
     uncharted_total = front_totals[-1]
     front_totals = front_totals[:-1]
-    
+
     # upate tallies with adjusted weights
     for tally, front_total in zip(tallies, front_totals):
         tally.update_weights(front_total)
 
     return FrontTally.for_other(num_uncharted_cells, uncharted_total)
 
+class MineCountVector(object):
+    """a sequence of totals (numbers of a numeric backend) indexed by # of
+    mines, for all # of mines between min_mines and max_mines"""
+
+    def __init__(self, min_mines, totals):
+        self.min_mines = min_mines
+        self.totals = totals
+
+    @property
+    def max_mines(self):
+        return self.min_mines + len(self.totals) - 1
+
+    @staticmethod
+    def unit(numeric):
+        """the vector for an empty combination of fronts"""
+        return MineCountVector(0, [numeric.number(1)])
+
+    @staticmethod
+    def from_totals(totals, numeric):
+        """build from a mapping: # mines -> total"""
+        min_mines = min(totals)
+        zero = numeric.number(0)
+        return MineCountVector(min_mines, [totals.get(n, zero) for n in xrange(min_mines, max(totals) + 1)])
+
+    def can_combine_to(self, other, num_mines):
+        """whether any entries of this and 'other' sum to 'num_mines' mines"""
+        return self.min_mines + other.min_mines <= num_mines <= self.max_mines + other.max_mines
+
+    def convolve_at(self, other, num_mines, numeric):
+        """return the combined total of this and 'other' for 'num_mines' mines"""
+        lo = max(self.min_mines, num_mines - other.max_mines)
+        hi = min(self.max_mines, num_mines - other.min_mines)
+        if lo > hi:
+            return numeric.number(0)
+        return numeric.dot(self.totals[lo - self.min_mines:hi - self.min_mines + 1],
+                           [other.totals[num_mines - n - other.min_mines] for n in xrange(lo, hi + 1)])
+
+    def convolve(self, other, min_mines, max_mines, numeric):
+        """return the combination of this and 'other', keeping only the
+        entries between min_mines and max_mines"""
+        min_mines = max(min_mines, self.min_mines + other.min_mines)
+        max_mines = min(max_mines, self.max_mines + other.max_mines)
+        return MineCountVector(min_mines, [self.convolve_at(other, n, numeric) for n in xrange(min_mines, max_mines + 1)])
+
+    def __iter__(self):
+        return enumerate(self.totals, self.min_mines)
+
+    def __repr__(self):
+        return str(dict(self))
+
 def possible_mine_limits(tallies):
     """return the total minimum and maximum possible # of mines across all
     tallied fronts
@@ -1226,7 +3015,7 @@ def possible_mine_limits(tallies):
     returns (min, max)"""
     return (sum(f(tally) for tally in tallies) for f in (lambda tally: tally.min_mines(), lambda tally: tally.max_mines()))
 
-def nondiscrete_relative_likelihood(p, k, k0):
+def nondiscrete_relative_likelihood(p, k, k0, numeric=NUMERIC_BACKENDS['log']):
     """given binomial probability (p,k,n) => p^k*(1-p)^(n-k),
     return binom_prob(p,k,n) / binom_prob(p,k0,n)
 
@@ -1234,19 +3023,22 @@ def nondiscrete_relative_likelihood(p, k, k0):
     per-configuration weight, and in a true binomial distribution we'd then
     multiply by (n choose k) configurations; however, we've effectively done
     that already with the enumeration/tallying phase
+
+    result is in the representation of numeric backend 'numeric'
     """
 
     if p < 0. or p > 1.:
         raise ValueError('p must be [0., 1.]')
 
-    return float((p / (1 - p))**(k - k0))
+    return numeric.power(p / (1 - p), k - k0)
 
-def discrete_relative_likelihood(n, k, k0):
-    """return 'n choose k' / 'n choose k0'"""
+def discrete_relative_likelihood(n, k, k0, numeric=NUMERIC_BACKENDS['log']):
+    """return 'n choose k' / 'n choose k0', in the representation of numeric
+    backend 'numeric'"""
     if any(x < 0 or x > n for x in (k, k0)):
         raise ValueError('k, k0 must be [0, n]')
 
-    return float(fact_div(k0, k) * fact_div(n - k0, n - k))
+    return numeric.binomial_ratio(n, k, k0)
 
 class UnchartedCell(ImmutableMixin):
     """a meta-cell object that represents all the 'other' cells on the board
@@ -1282,9 +3074,17 @@ class FixedProbTally(ImmutableMixin):
     def _canonical(self):
         return (self.p,)
 
-def expand_cells(cell_probs, other_tag):
+def expand_cells(cell_probs, other_tag, names=None):
     """back-convert the expected values for all supercells into per-cell
-    probabilities for each original cell"""
+    probabilities for each original cell
+
+    names -- if cells were interned, the list of original cells, indexed by
+        id (see CellIndex)
+    """
     for cell_, p in cell_probs:
         for cell in cell_:
-            yield (cell if cell is not None else other_tag, p / len(cell_))
+            if cell is None:
+                cell = other_tag
+            elif names is not None:
+                cell = names[cell]
+            yield (cell, p / len(cell_))
@@ -1,6 +1,8 @@
 import unittest
 import collections
+import itertools
 import re
+import minesweeper
 from minesweeper import *
 
 def sets(o):
@@ -25,6 +27,18 @@ def P(s):
     assert len(sp) % 2 == 1 and not sp[-1]
     return Permutation((frozenset(sp[i]), int(sp[i+1])) for i in xrange(0, len(sp[:-1]), 2))
 
+def wall(n=8, prefix='a', side='b'):
+    """helper function to generate a 'wall' of n raw Rules, each overlapping
+    the next: a single long front with very many configurations"""
+    return [Rule(1, ['%s%d' % (prefix, 2 * i), '%s%d' % (prefix, 2 * i + 1), '%s%d' % (prefix, 2 * i + 2), '%s%d' % (side, i)])
+            for i in xrange(n)]
+
+def clear_front_cache():
+    """helper function to forget the fronts tallied by earlier solves, so that
+    the next solve enumerates afresh"""
+    if minesweeper.front_shape_cache is not None:
+        minesweeper.front_shape_cache.clear()
+
 class Test(unittest.TestCase):
     def test_rule_init(self):
         self.assertEqual(R('0:').num_cells, 0)
@@ -108,6 +122,24 @@ class Test(unittest.TestCase):
         compare([r('1:a,b,c'), r('2:b,c,d'), r('0:c,e')], [R('1:a,b,c'), R('2:b,c,d'), R('0:c,e')], 'a,b,c,d,e')
         compare([r('1:a,b,c'), r('2:b,c,d'), r('0:b,c,e,f')], [R('1:a,bc'), R('2:bc,d'), R('0:bc,ef')], 'a,bc,d,ef')
 
+    def test_cell_masks(self):
+        index = CellIndex()
+        for cell in 'abcdexy':
+            index.intern(cell)
+        rules = [index.intern_rule(r(s)) for s in ('2:a,b,c,d', '1:a,b', '1:c,e', '1:x,y')]
+        self.assertEqual(index.names, ['a', 'b', 'c', 'd', 'e', 'x', 'y'])
+        (abcd, ab, ce, xy), cells_ = condense_supercells(rules)
+        self.assertEqual(ab.mask, 0b11)
+        self.assertEqual(abcd.mask, 0b1111)
+        self.assertTrue(ab.is_subrule_of(abcd))
+        self.assertFalse(abcd.is_subrule_of(ab))
+        self.assertFalse(ce.is_subrule_of(abcd))
+        self.assertEqual(abcd.subtract(ab).mask, 0b1100)
+        full = Rule_(2, abcd.subtract(ab).cells_, mask=0b1100)
+        self.assertEqual(set(rule.mask for rule in full.decompose()), set([0b100, 0b1000]))
+        self.assertEqual(CellRulesMap([abcd, ab, ce, xy]).partition(), sets([[abcd, ab, ce], [xy]]))
+        self.assertEqual(dict(expand_cells([(set_([0, 2]), 1.)], None, index.names)), {'a': .5, 'c': .5})
+
     def test_rule_reduce_metric(self):
         # supercells don't matter
         self.assertEqual(Reduceable(R('3:a,b,cde'), R('1:a,b')).metric(), Reduceable(R('3:a,b,c,d,e'), R('1:ab')).metric())
@@ -135,6 +167,17 @@ class Test(unittest.TestCase):
         # decomposition then reduction
         self.assertEqual(reduce_rules([R('1:a,b,c,d'), R('0:c,d,e')]), set([R('1:a,b'), R('0:c'), R('0:d'), R('0:e')]))
         self.assertEqual(reduce_rules([R('3:a,b,c,d'), R('3:c,d,e')]), set([R('1:a,b'), R('1:c'), R('1:d'), R('1:e')]))
+        # many reductions of equal priority
+        self.assertEqual(reduce_rules([R('1:%s,%s' % (c, c.upper())) for c in 'abcdef'] + [R('3:a,A,b,B,c,C,x')]),
+                         set([R('1:%s,%s' % (c, c.upper())) for c in 'abcdef'] + [R('0:x')]))
+
+    def test_subset_relations(self):
+        rules = [R('1:a,b,c'), R('1:a,b'), R('2:a,b'), R('1:c,d'), R('1:b'), R('1:a,b,c,d')]
+        subrules, superrules = CellRulesMap(rules).subset_relations(R('1:a,b'))
+        self.assertEqual(set(subrules), set([R('2:a,b'), R('1:b')]))
+        self.assertEqual(set(superrules), set([R('1:a,b,c'), R('1:a,b,c,d')]))
+        subrules, superrules = CellRulesMap(rules).subset_relations(R('0:e'))
+        self.assertEqual((subrules, superrules), ([], []))
 
     def test_permute(self):
         pset = lambda r: PermutationSet.from_rule(r).permus
@@ -178,6 +221,17 @@ class Test(unittest.TestCase):
         self.assertEqual(P('a0').combine(P('b1')), P('a0b1'))
         self.assertEqual(P('abc2de1f0').combine(P('abc2de1ghi2')), P('abc2de1f0ghi2'))
 
+    def test_permutation_order(self):
+        import pickle
+        permus = PermutationSet.from_rule(R('2:a,b,cd')).permus
+        # permutations over the same cells share a single cell order
+        self.assertEqual(len(set(id(p.order) for p in permus)), 1)
+        self.assertTrue(P('a1b1cd0').order is peek(permus).order)
+        self.assertEqual(P('a1b0cd1')[set_('cd')], 1)
+        self.assertEqual(P('a1b0cd1').mapping, {set_('a'): 1, set_('b'): 0, set_('cd'): 1})
+        self.assertEqual(pickle.loads(pickle.dumps(P('a1b0cd1'))), P('a1b0cd1'))
+        self.assertEqual(set(pickle.loads(pickle.dumps(permus))), permus)
+
     def test_permutation_multiplicity(self):
         self.assertEqual(P('a0b1c0d1').multiplicity(), 1)
         self.assertEqual(P('ab0def3ghij0k1').multiplicity(), 1)
@@ -231,12 +285,27 @@ class Test(unittest.TestCase):
                 pset.remove(p)
         self.assertEqual(_(pset.decompose()), _([subset1, subset2]))
 
+        # many cells, all pairwise independent, yet indecomposable
+        pset = PermutationSet.from_rule(R('5:a,b,c,d,e,f,g,h,i,j,k,l'))
+        pset.remove(peek(pset.permus))
+        self.assertEqual(_(pset.decompose()), _([pset]))
+        # three-way decomposition, with factors interleaved in cell order
+        subsets = [PermutationSet.from_rule(R(s)) for s in ('1:a,d,g', '2:b,e,h', '1:c,f')]
+        pset = PermutationSet.from_rule(R('4:a,b,c,d,e,f,g,h'))
+        for p in list(pset.permus):
+            if not all(any(p.compatible(sp) for sp in subset.permus) for subset in subsets):
+                pset.remove(p)
+        self.assertEqual(_(pset.decompose()), _(subsets))
+
     def test_ruleset_cross_eliminate_and_rereduce(self):
         def compare(rules, output, rereduced=None):
             _ = lambda prs: set(set_(ps.permus) for ps in prs.permu_map.values())
 
             prs = PermutedRuleset(set(rules))
-            prs.cross_eliminate()
+            num_permus = sum(len(ps.permus) for ps in prs.permu_map.values())
+            num_checks, num_eliminated = prs.cross_eliminate()
+            self.assertEqual(num_eliminated, num_permus - sum(len(ps.permus) for ps in prs.permu_map.values()))
+            self.assertTrue(num_checks >= num_eliminated)
             if output is not None:
                 self.assertEqual(_(prs), sets(output))
             prs.rereduce()
@@ -328,6 +397,513 @@ class Test(unittest.TestCase):
     # trivial front?
 
 
+    def test_front_shape(self):
+        def front(rules):
+            return peek(permute_and_interfere(set(rules)).split_fronts())
+        def tally(t):
+            return dict((num_mines, (subtally.total, subtally.tally)) for num_mines, subtally in t)
+        def enumerate_uncached(front):
+            t = FrontTally()
+            t.tally(front)
+            return t
+
+        a = front([R('1:a,b'), R('1:b,c'), R('1:c,de')])
+        # same shape with different cell names, mirrored
+        b = front([R('1:yz,x'), R('1:x,w'), R('1:w,v')])
+        # same incidence structure but a different supercell size
+        c = front([R('1:a,b'), R('1:b,c'), R('1:c,d')])
+        self.assertEqual(FrontShape(a).key, FrontShape(b).key)
+        self.assertNotEqual(FrontShape(a).key, FrontShape(c).key)
+
+        shape = FrontShape(a)
+        self.assertEqual(tally(shape.tally(shape.canonical_tally(enumerate_uncached(a)))), tally(enumerate_uncached(a)))
+        cached = FrontShape(b).tally(shape.canonical_tally(enumerate_uncached(a)))
+        self.assertEqual(tally(cached), tally(enumerate_uncached(b)))
+
+    def test_solver_session(self):
+        def compare(a, b):
+            self.assertEqual(set(a), set(b))
+            for cell in a:
+                self.assertAlmostEqual(a[cell], b[cell])
+
+        rules = [r('1:a,b'), r('2:a,b,c'), r('3:b,c,d'), r('2:c,d,e'), r('2:d,e,f,g,h'), r('1:g,h,i'), r('1:h,i')]
+        other = [r('1:x,y'), r('1:y,z')]
+        mine_prevalence = MineCount(85, 12)
+
+        session = SolverSession(rules)
+        compare(session.solve(mine_prevalence), solve(rules, mine_prevalence))
+        session.add_rules(other)
+        compare(session.solve(mine_prevalence), solve(rules + other, mine_prevalence))
+        self.assertEqual(len(session.front_cache), 2)
+
+        # the unchanged front is served from the cache
+        session.remove_rules([r('1:y,z')])
+        compare(session.solve(mine_prevalence), solve(rules + [r('1:x,y')], mine_prevalence))
+        self.assertEqual(len(session.front_cache), 2)
+        self.assertRaises(KeyError, lambda: session.remove_rules([r('1:y,z')]))
+
+        session.set_rules(rules)
+        compare(session.solve(.2), solve(rules, .2))
+
+    def test_count_front(self):
+        def tallies(rules, engine):
+            fronts = permute_and_interfere(set(rules)).split_fronts()
+            return set_(set_((num_mines, subtally.total, set_(subtally.tally.iteritems()))
+                             for num_mines, subtally in TALLY_ENGINES[engine](f))
+                        for f in fronts if not f.is_trivial())
+
+        for rules in ([R('1:a,b,c'), R('2:b,c,d')],
+                      [R('2:a,b,c,d'), R('1:c,d,e'), R('1:e,fgh,i'), R('2:i,j,a')],
+                      [R('3:a,b,c,d,e,f'), R('1:e,f,y'), R('2:a,b,c,d,x'), R('1:x,k,l'), R('2:k,l,m'), R('1:b,c,q')],
+                      # long wall with many configurations
+                      [Rule_(1, set_(set_([c]) for c in rule.cells)) for rule in wall()]):
+            self.assertEqual(tallies(rules, 'count'), tallies(rules, 'enumerate'))
+
+        prs = PermutedRuleset(set([R('1:a,b'), R('1:b,c')]))
+        for p in (P('a1b0'), P('b1c0')):
+            peek(ps for ps in prs.permu_map.values() if p in ps).remove(p)
+        self.assertRaises(InconsistencyError, lambda: count_front(prs))
+
+    def test_parallel_fronts(self):
+        import multiprocessing
+        # complex enough to be sent to the pool
+        other = [r('1:A,B,C'), r('1:C,D,E')]
+        mine_prevalence = MineCount(100, 20)
+        expected = solve(wall() + other, mine_prevalence)
+
+        pool = multiprocessing.Pool(2)
+        try:
+            self.assertEqual(executor_workers(pool), 2)
+            clear_front_cache()
+            solution = solve(wall() + other, mine_prevalence, executor=pool)
+
+            # complex enough to be split, but inconsistent, as only enumeration finds
+            cycle = [r('1:A,B'), r('1:B,C'), r('1:C,A'), Rule(1, ['A', 'a0', 'Z'])]
+            front = peek(f for f in permute_and_interfere(set(condense_supercells(wall() + cycle)[0])).split_fronts()
+                         if not f.is_trivial())
+            self.assertTrue(front.complexity() >= SPLIT_MIN_COMPLEXITY)
+            self.assertRaises(InconsistencyError, lambda: solve(wall() + cycle, mine_prevalence, executor=pool))
+        finally:
+            pool.terminate()
+        self.assertEqual(executor_workers(object()), multiprocessing.cpu_count())
+        self.assertEqual(set(solution), set(expected))
+        for cell in expected:
+            self.assertAlmostEqual(solution[cell], expected[cell])
+
+        # splitting a front's enumeration into subtrees gives the same tally
+        front = peek(f for f in permute_and_interfere(set(condense_supercells(wall())[0])).split_fronts() if not f.is_trivial())
+        key = FrontShape(front).key
+        tasks = split_shape(key, 10)
+        self.assertTrue(len(tasks) >= 10)
+        whole = tally_shape((key, 'enumerate'))
+        merged = merge_subtree_tallies(map(front_task, tasks))
+        self.assertEqual(set(whole), set(merged))
+        for num_mines, (total, expected) in whole.iteritems():
+            self.assertEqual(merged[num_mines][0], total)
+            for a, b in zip(merged[num_mines][1], expected):
+                self.assertAlmostEqual(a, b)
+
+    def test_numeric_backends(self):
+        x, y = LogNumber.of(10**400), LogNumber.of(3 * 10**400)
+        self.assertAlmostEqual(float(x / (x + y)), .25)
+        self.assertAlmostEqual(float(x * y / (y * y)), 1 / 3.)
+        self.assertAlmostEqual(float(sum([LogNumber.of(0), x, 0]) / x), 1.)
+        self.assertAlmostEqual(float(NUMERIC_BACKENDS['log'].binomial_ratio(5000, 999, 1000)),
+                               float(NUMERIC_BACKENDS['exact'].binomial_ratio(5000, 999, 1000)))
+
+        # configuration counts far too large to convert to floats
+        def tallies():
+            A, B = set_('ab'), set_('cde')
+            return set([FrontTally({1: FrontSubtally.mk(10**400, {A: 1.}), 2: FrontSubtally.mk(7 * 10**401, {A: 2.})}),
+                        FrontTally({0: FrontSubtally.mk(2 * 10**350, {B: 0.}), 3: FrontSubtally.mk(10**351, {B: 3.})})])
+        for mine_prevalence in (MineCount(5000, 1000), .3):
+            solutions = [dict(cell_probabilities(tallies(), mine_prevalence, [set_('ab'), set_('cde')], NUMERIC_BACKENDS[numeric]))
+                         for numeric in ('log', 'exact')]
+            self.assertEqual(set(solutions[0]), set(solutions[1]))
+            for cell in solutions[0]:
+                self.assertAlmostEqual(solutions[0][cell], solutions[1][cell])
+
+        rules = [r('1:A,B,C'), r('2:C,D,E,F'), r('1:F,G')]
+        for mine_prevalence in (MineCount(50, 10), .2):
+            expected = solve(rules, mine_prevalence, numeric='exact')
+            solution = solve(rules, mine_prevalence)
+            for cell in expected:
+                self.assertAlmostEqual(solution[cell], expected[cell])
+
+    def test_front_tally_batches(self):
+        rules = [R('2:a,b,c,d'), R('1:c,d,e'), R('1:e,fgh,i'), R('2:i,j,a')]
+        front = peek(permute_and_interfere(set(rules)).split_fronts())
+        configs = list(front.enumerate())
+
+        def naive(configs):
+            tally = collections.defaultdict(lambda: [0, collections.defaultdict(int)])
+            for config in configs:
+                entry = tally[config.k()]
+                entry[0] += config.multiplicity()
+                for cell_, n in config.iteritems():
+                    entry[1][cell_] += n * config.multiplicity()
+            return dict((k, (total, dict(sums))) for k, (total, sums) in tally.iteritems())
+
+        for batch_size in (1, 3, 1024):
+            tally = FrontTally()
+            tally.BATCH_SIZE = batch_size
+            tally.accumulate(configs)
+            self.assertEqual(dict((k, (subtally.total, subtally.tally)) for k, subtally in tally), naive(configs))
+
+        tally.finalize()
+        for k, subtally in tally.copy():
+            self.assertEqual(subtally.tally, tally.subtallies[k].tally)
+            self.assertAlmostEqual(sum(subtally.values), k)
+
+    def test_mine_count_vector(self):
+        exact = NUMERIC_BACKENDS['exact']
+        a = MineCountVector.from_totals({1: 2, 3: 5}, exact)
+        b = MineCountVector(0, [1, 4, 3])
+        self.assertEqual(dict(a), {1: 2, 2: 0, 3: 5})
+        # (2x + 5x^3) * (1 + 4x + 3x^2)
+        self.assertEqual(dict(a.convolve(b, 0, 10, exact)), {1: 2, 2: 8, 3: 11, 4: 20, 5: 15})
+        self.assertEqual(dict(a.convolve(b, 3, 4, exact)), {3: 11, 4: 20})
+        self.assertEqual(a.convolve_at(b, 4, exact), 20)
+        self.assertEqual(a.convolve_at(b, 6, exact), 0)
+        self.assertFalse(a.can_combine_to(b, 6))
+
+        log = NUMERIC_BACKENDS['log']
+        c = MineCountVector(1, map(log.number, [2, 0, 5])).convolve(MineCountVector(0, map(log.number, [1, 4, 3])), 0, 10, log)
+        self.assertEqual([round(float(n), 9) for n in c.totals], [2, 8, 11, 20, 15])
+
+    def test_approximate(self):
+        rules = wall() + [Rule(2, ['c%d' % i for i in xrange(6)]), r('1:A,B,C')]
+        mine_prevalence = MineCount(80, 20)
+        exact = solve(rules, mine_prevalence)
+        self.assertTrue(exact.intervals is None)
+
+        # fronts within budget are still tallied exactly
+        solution = solve(rules, mine_prevalence, mode='approximate', budget=10**6)
+        self.assertTrue(solution.intervals is None)
+
+        solution = solve(rules, mine_prevalence, mode='approximate', budget=500, seed=0)
+        self.assertEqual(set(solution), set(exact))
+        self.assertEqual(set(solution.intervals), set(exact))
+        for cell, p in exact.iteritems():
+            lo, hi = solution.intervals[cell]
+            self.assertTrue(0. <= lo <= solution[cell] <= hi <= 1.)
+            self.assertTrue(abs(solution[cell] - p) < .1)
+        # only the wall is sampled
+        for bound in solution.intervals['c0']:
+            self.assertAlmostEqual(bound, exact['c0'])
+
+        self.assertRaises(ValueError, lambda: solve(rules, mine_prevalence, mode='bogus'))
+
+    def test_deadline(self):
+        rules = wall() + [r('1:A,B'), r('2:C,D')]
+        mine_prevalence = MineCount(80, 20)
+        exact = solve(rules, mine_prevalence)
+        self.assertEqual(exact.estimated, set())
+
+        self.assertRaises(DeadlineExceeded, Deadline(0).check)
+        clear_front_cache()
+        solution = solve(rules, mine_prevalence, deadline=0, seed=0)
+        self.assertEqual(set(solution), set(exact))
+        self.assertEqual(solution.estimated, set(itertools.chain(*(rule.cells for rule in wall()))))
+        # determined cells are still exact
+        self.assertEqual((solution['C'], solution['D']), (1., 1.))
+        for cell, p in exact.iteritems():
+            self.assertTrue(abs(solution[cell] - p) < .1)
+
+        # no time even to sample: a crude estimate, rather than an error
+        import minesweeper
+        fallback_time = minesweeper.DEADLINE_FALLBACK_TIME
+        minesweeper.DEADLINE_FALLBACK_TIME = 0
+        try:
+            clear_front_cache()
+            solution = solve(rules, mine_prevalence, deadline=0)
+        finally:
+            minesweeper.DEADLINE_FALLBACK_TIME = fallback_time
+        self.assertEqual(set(solution), set(exact))
+        self.assertEqual(solution.estimated, set(itertools.chain(*(rule.cells for rule in wall()))))
+        self.assertEqual((solution['C'], solution['D']), (1., 1.))
+        self.assertTrue(all(0. <= p <= 1. for p in solution.values()))
+
+    def test_cancel(self):
+        rules = wall(12) + [r('1:A,B,C'), r('1:C,D')]
+        mine_prevalence = MineCount(100, 25)
+
+        progress = []
+        clear_front_cache()
+        solve(rules, mine_prevalence, cancel=CancelToken(lambda phase, count: progress.append(phase)))
+        self.assertEqual(set(progress), set(['reduce', 'enumerate']))
+
+        def cancel_midway(phase, count):
+            if phase == 'enumerate':
+                token.cancel()
+        token = CancelToken(cancel_midway)
+        clear_front_cache()
+        self.assertRaises(SolveCancelled, lambda: solve(rules, mine_prevalence, cancel=token))
+        # a cancellation is not mistaken for running out of time
+        clear_front_cache()
+        self.assertRaises(SolveCancelled, lambda: solve(rules, mine_prevalence, deadline=60, cancel=token))
+        self.assertTrue(token.cancelled)
+
+    def test_solve_stats(self):
+        rules = wall() + [r('1:A,B,C'), r('1:C,D'), r('0:E')]
+        mine_prevalence = MineCount(100, 25)
+
+        clear_front_cache()
+        stats = SolveStats()
+        self.assertAlmostEqual(solve(rules, mine_prevalence, stats=stats)['C'], .6, 3)
+        self.assertEqual(stats.timings.keys(), SolveStats.PHASES)
+        self.assertTrue(all(t >= 0 for t in stats.timings.values()))
+        self.assertEqual(stats.counters['rules'], 11)
+        self.assertEqual(stats.counters['fronts'], 2)
+        self.assertTrue(stats.counters['configurations'] > 0)
+        self.assertTrue(stats.counters['elimination_checks'] > 0)
+        self.assertEqual(sorted(f['rules'] for f in stats.fronts), [2, 8])
+        self.assertTrue(all(f['time'] is not None for f in stats.fronts))
+
+        # found in cache; nothing enumerated
+        stats = SolveStats()
+        solve(rules, mine_prevalence, stats=stats)
+        self.assertEqual(stats.counters['configurations'], 0)
+
+    def test_cost_estimate(self):
+        small = [r('1:A,B,C'), r('1:C,D')]
+        self.assertEqual(estimate_cost([r('0:A'), r('1:B')]), (0, []))
+        total, costs = estimate_cost(wall(8) + small)
+        self.assertEqual(len(costs), 2)
+        self.assertEqual(total, sum(costs))
+        self.assertTrue(costs[0] > costs[1])
+        # enumeration grows exponentially along the wall; counting, linearly
+        self.assertTrue(estimate_cost(wall(16), 'enumerate')[0] > 10 * estimate_cost(wall(8), 'enumerate')[0])
+        self.assertTrue(estimate_cost(wall(16), 'count')[0] < 3 * estimate_cost(wall(8), 'count')[0])
+        self.assertTrue(estimate_cost(wall(16))[0] <= estimate_cost(wall(16), 'count')[0])
+
+        mine_prevalence = MineCount(100, 25)
+        clear_front_cache()
+        expected = solve(wall(8) + small, mine_prevalence)
+        clear_front_cache()
+        for k, v in solve(wall(8) + small, mine_prevalence, engine='auto').iteritems():
+            self.assertAlmostEqual(v, expected[k])
+        clear_front_cache()
+        self.assertRaises(CostExceeded, lambda: solve(wall(8) + small, mine_prevalence, max_cost=costs[1]))
+        solve(wall(8) + small, mine_prevalence, max_cost=total)
+
+        # the api settles for an approximate solution instead
+        import minesweeper_util
+        payload = {'rules': [{'num_mines': rule.num_mines, 'cells': list(rule.cells)} for rule in wall(8) + small],
+                   'total_cells': 100, 'total_mines': 25, 'max_cost': costs[1], 'budget': 10}
+        result = minesweeper_util.api_solve(payload)
+        self.assertTrue(result['approximated'])
+        self.assertEqual(result['cost'], total)
+        self.assertTrue(result['intervals'])
+        result = minesweeper_util.api_solve(dict(payload, mode='approximate', max_cost=costs[1] / 2.))
+        self.assertEqual((result['solution'], result['error']), (None, 'too costly'))
+
+    def test_solve_many(self):
+        import multiprocessing
+        problems = [
+            (wall() + [r('1:A,B,C')], MineCount(100, 20)),
+            (wall(), .2),
+            # relabeling of the first front
+            (wall(prefix='z', side='bz') + [r('1:C,D')], MineCount(60, 10)),
+            ([r('1:A,B'), r('2:A,B')], .2),
+            # only found out when enumerating
+            ([r('1:A,B'), r('1:B,C'), r('1:C,A')], .2),
+            ([r('0:A')], MineCount(5, 1)),
+            ([], MineCount(10, 11)),
+        ]
+        def compare(solutions):
+            self.assertEqual(len(solutions), len(problems))
+            for (rules, mine_prevalence), solution in zip(problems, solutions):
+                try:
+                    expected = solve(rules, mine_prevalence, '_other')
+                except InconsistencyError:
+                    self.assertEqual(solution, None)
+                    continue
+                self.assertEqual(set(solution), set(expected))
+                for k, v in expected.iteritems():
+                    self.assertAlmostEqual(solution[k], v)
+
+        clear_front_cache()
+        stats = SolveStats()
+        compare(solve_many(problems, '_other', stats=stats))
+        self.assertEqual(stats.counters['fronts'], 4)
+        # the wall was only enumerated once
+        clear_front_cache()
+        wall_stats = SolveStats()
+        solve(wall(), .2, stats=wall_stats)
+        self.assertEqual(stats.counters['configurations'], wall_stats.counters['configurations'])
+
+        # the inconsistent front is tallied first (simplest first, given a
+        # token), cutting short the batch; the retries still make the stats
+        stats = SolveStats()
+        solve_many(problems, '_other', cancel=CancelToken(), stats=stats)
+        self.assertTrue(8 in [f['rules'] for f in stats.fronts])
+
+        # inconsistent, but only found out once split among the workers
+        problems.append((wall() + [r('1:A,B'), r('1:B,C'), r('1:C,A'), Rule(1, ['A', 'a0', 'Z'])], .2))
+        clear_front_cache()
+        compare(solve_many(problems, '_other'))
+        clear_front_cache()
+        pool = multiprocessing.Pool(2)
+        try:
+            solutions = solve_many(problems, '_other', executor=pool)
+            self.assertEqual(solutions[-1], None)
+            compare(solutions)
+        finally:
+            pool.terminate()
+
+    def test_wire(self):
+        import wire
+        import json
+        def roundtrip(o):
+            self.assertEqual(wire.loads(wire.dumps(o)), o)
+            # plain json is accepted too
+            self.assertEqual(wire.loads(json.dumps(o)), o)
+
+        payload = {'rules': [{'num_mines': 1, 'cells': [u'1-1', u'1-2']}, {'num_mines': 2, 'cells': [u'1-2', u'2-3', u'2-4']}],
+                   'total_cells': 10, 'total_mines': 4}
+        roundtrip({'task': u'x.y', 'args': [payload], 'kwargs': {}})
+        roundtrip({u'problems': [payload, {'board': u'1x', 'total_mines': 1}, {'rules': []}]})
+        result = {u'solution': {u'1-1': 1/3., u'1-2': 0., u'2-3': 1., u'_other': .1}, u'processing_time': .5}
+        roundtrip({u'result': result})
+        roundtrip({u'result': {u'solutions': [result['solution'], None]}})
+        # not of the expected form; left as is
+        roundtrip({u'rules': [{u'num_mines': 1, u'cells': [u'a'], u'extra': 0}], u'solution': {u'a': 1}})
+        # dicts of our own that look packed
+        roundtrip({u'_packed': u'rules', u'cells': [u'a'], u'blob': 0})
+        roundtrip({u'x': {u'_packed': u'dict', u'items': {u'_packed': u'solution'}}, u'solution': {u'_packed': .5}})
+
+    def test_result_cache(self):
+        import minesweeper_util
+        key = minesweeper_util.canonical_key
+        payload = {'rules': [{'num_mines': 1, 'cells': ['a', 'b']}, {'num_mines': 2, 'cells': ['b', 'c', 'd']}],
+                   'total_cells': 10, 'total_mines': 4}
+        shuffled = {'total_mines': 4, 'total_cells': 10, 'deadline': 3.5,
+                    'rules': [{'num_mines': 2, 'cells': ['d', 'c', 'b']}, {'num_mines': 1, 'cells': ['b', 'a']}]}
+        self.assertEqual(key(payload), key(shuffled))
+        self.assertNotEqual(key(payload), key(dict(payload, total_mines=5)))
+        self.assertNotEqual(key(payload), key(dict(payload, mode='approximate')))
+        self.assertEqual(key({'board': '1x\n', 'total_mines': 1}), key({'board': ' 1x', 'total_mines': 1}))
+
+        cache = minesweeper_util.ResultCache(max_cells=10)
+        result = minesweeper_util.api_solve(payload, cache=cache)
+        self.assertFalse(result.get('cached'))
+        cached = minesweeper_util.api_solve(shuffled, cache=cache)
+        self.assertTrue(cached['cached'])
+        self.assertEqual(cached['solution'], result['solution'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # incomplete results are not kept
+        cache.put('x', {'solution': None, 'error': 'too costly'})
+        self.assertEqual(cache.get('x'), None)
+        # nor are invalid requests
+        for bad in [{'mode': 'exactly'}, {'budget': 0}, {'budget': 2.5}, {'mode': 'approximate', 'budget': '10'},
+                    {'engine': 'bogus'}, {'max_cost': 'lots'}, {'max_cost': -1}, {'deadline': 'soon'},
+                    {'deadline': -.5}]:
+            result = minesweeper_util.api_solve(dict(payload, **bad), cache=cache)
+            self.assertEqual(result['solution'], None)
+            self.assertTrue(result['error'])
+        result = minesweeper_util.api_solve_batch({'problems': [payload, dict(payload, mode='exactly')]})
+        self.assertEqual(result['solutions'], None)
+        self.assertTrue('exactly' in result['error'])
+        result = minesweeper_util.api_solve_batch({'problems': [payload], 'engine': 'bogus'})
+        self.assertTrue('bogus' in result['error'])
+        # invalid requests are turned away before the cache is consulted
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        # evicted once too many cells are cached
+        minesweeper_util.api_solve(dict(payload, total_mines=5), cache=cache)
+        minesweeper_util.api_solve(dict(payload, total_mines=3), cache=cache)
+        self.assertEqual(cache.get(key(payload)), None)
+        self.assertTrue(cache.counters()['cells'] <= 10)
+
+    def test_front_store(self):
+        import minesweeper
+        import os.path
+        import shutil
+        import tempfile
+        rules = wall() + [r('1:A,B,C'), r('1:C,D')]
+        mine_prevalence = MineCount(100, 25)
+        expected = solve(rules, mine_prevalence)
+
+        dir = tempfile.mkdtemp()
+        path = os.path.join(dir, 'fronts.db')
+        memory_cache = minesweeper.front_shape_cache
+        try:
+            store = open_front_store(path)
+            self.assertTrue(minesweeper.front_shape_cache is store)
+            solve(rules, mine_prevalence)
+            self.assertEqual(len(store), 2)
+
+            # as if in a new process
+            store = open_front_store(path)
+            self.assertEqual(len(store.memory), 0)
+            stats = SolveStats()
+            solution = solve(rules, mine_prevalence, stats=stats)
+            self.assertEqual(stats.counters['configurations'], 0)
+            for k, v in expected.iteritems():
+                self.assertAlmostEqual(solution[k], v)
+
+            store.clear()
+            self.assertEqual(len(store), 0)
+
+            # a database that can't be opened leaves just the memory cache
+            store = open_front_store(os.path.join(dir, 'nonexistent', 'fronts.db'))
+            for k, v in solve(rules, mine_prevalence).iteritems():
+                self.assertAlmostEqual(solution[k], v)
+            self.assertEqual(len(store), 2)
+            stats = SolveStats()
+            solve(rules, mine_prevalence, stats=stats)
+            self.assertEqual(stats.counters['configurations'], 0)
+        finally:
+            minesweeper.front_shape_cache = memory_cache
+            shutil.rmtree(dir)
+
+    def test_cell_order(self):
+        import gc
+        a, b = P('a1b0'), P('b1c1')
+        self.assertTrue(a.order.union(b.order)[0] is CellOrder.get(map(set_, 'abc')))
+        self.assertEqual(a.order.overlap(b.order), ((a.order.index[set_('b')],), (b.order.index[set_('b')],)))
+        self.assertEqual(a.order.suborder([set_('a')])[1], (a.order.index[set_('a')],))
+        # memoized relationships don't keep orders alive
+        key = set_(map(set_, 'bc'))
+        self.assertTrue(key in CellOrder._interned)
+        del b
+        gc.collect()
+        self.assertFalse(key in CellOrder._interned)
+
+    def test_concurrent_solves(self):
+        import threading
+        cache = LRUCache(50)
+        def churn(offset):
+            for i in xrange(20000):
+                cache[(offset + i) % 80] = i
+                cache.get((offset + 2 * i) % 80)
+        threads = [threading.Thread(target=churn, args=(k,)) for k in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(cache.size, len(cache.data))
+        self.assertTrue(len(cache) <= 50)
+
+        # solves in threads share the front shape cache and the interned cell orders
+        boards = [wall(n, c, 'b' + c) for c, n in zip('pqrs', (5, 6, 5, 7))]
+        expected = [solve(rules, .2) for rules in boards]
+        clear_front_cache()
+        errors = []
+        def run(rules, expected):
+            try:
+                for i in xrange(20):
+                    solution = solve(rules, .2)
+                    assert all(abs(solution[k] - v) < 1e-9 for k, v in expected.iteritems())
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=args) for args in zip(boards, expected)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
     def test_uncharted_cell(self):
         c = UnchartedCell(0)
         self.assertEqual(len(c), 0)
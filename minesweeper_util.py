@@ -1,9 +1,41 @@
 import minesweeper as mnsw
+from util import LRUCache
+import hashlib
+import json
+import threading
 import time
 
 # utility / debugging code
 
+class PayloadError(ValueError):
+    """raise when an api payload asks for something that can't be done"""
+
+API_MODES = ['exact', 'approximate']
+
+def is_number(x):
+    return type(x) in (int, long, float)
+
+def check_api_options(payload):
+    """raise PayloadError if the solver options of an api payload are invalid"""
+    mode = payload.get('mode', 'exact')
+    if mode not in API_MODES:
+        raise PayloadError('unknown mode %r; must be one of %s' % (mode, ', '.join(API_MODES)))
+    budget = payload.get('budget')
+    if budget is not None and (type(budget) not in (int, long) or budget <= 0):
+        raise PayloadError('budget must be a positive integer, not %r' % (budget,))
+    engine = payload.get('engine', 'enumerate')
+    if engine not in mnsw.TALLY_ENGINES:
+        raise PayloadError('unknown engine %r; must be one of %s' % (engine, ', '.join(sorted(mnsw.TALLY_ENGINES))))
+    max_cost = payload.get('max_cost')
+    if max_cost is not None and not (is_number(max_cost) and max_cost >= 0):
+        raise PayloadError('max_cost must be a non-negative number, not %r' % (max_cost,))
+    deadline = payload.get('deadline')
+    if deadline is not None and not (is_number(deadline) and deadline >= 0):
+        raise PayloadError('deadline must be a non-negative number of seconds, not %r' % (deadline,))
+
 def parse_api_payload(payload):
+    check_api_options(payload)
+
     if 'board' in payload:
         rules, mine_p = read_board(payload['board'], payload['total_mines'], everything_mode=True)
     else:
@@ -15,17 +47,154 @@ def parse_api_payload(payload):
 
     return rules, mine_p
             
-def api_solve(payload):
-    rules, mine_p = parse_api_payload(payload)
-    
+def api_solve(payload, cancel=None, cache=None):
+    """solve a board described by a web api payload
+
+    cancel -- optional CancelToken with which to stop the solve early; it
+        then raises SolveCancelled
+    cache -- optional ResultCache to look the board up in first, and in
+        which to keep the result
+
+    a payload with an invalid 'mode', 'budget', 'engine', 'max_cost' or
+    'deadline' is not solved; the result has no solution, and instead an
+    'error' saying what is wrong
+
+    a board estimated to cost more than the payload's 'max_cost' to solve
+    exactly is instead solved in approximate mode; the result is then marked
+    'approximated', with the estimated 'cost'. (in approximate mode already,
+    it is not solved at all; the result has no solution, and instead an
+    'error' and the 'cost')
+    """
+    try:
+        rules, mine_p = parse_api_payload(payload)
+    except PayloadError, e:
+        return {'solution': None, 'error': str(e)}
+
+    if cache is not None:
+        key = canonical_key(payload)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    # optional: 'approximate' mode for boards too big to solve exactly, a
+    # deadline past which unfinished fronts are merely estimated, the tally
+    # engine, and a limit on the estimated cost beyond which not to solve exactly
+    options = dict((k, payload[k]) for k in ('mode', 'budget', 'deadline', 'engine', 'max_cost') if k in payload)
+
     result = {}
+    stats = mnsw.SolveStats()
     start = time.time()
     try:
-        result['solution'] = mnsw.solve(rules, mine_p, '_other')
+        try:
+            result['solution'] = mnsw.solve(rules, mine_p, '_other', cancel=cancel, stats=stats, **options)
+        except mnsw.CostExceeded, e:
+            if options.get('mode', 'exact') != 'exact':
+                raise
+            # too big to solve exactly; settle for an estimate
+            result['approximated'] = True
+            result['cost'] = e.cost
+            del options['max_cost']
+            options['mode'] = 'approximate'
+            stats = mnsw.SolveStats()
+            result['solution'] = mnsw.solve(rules, mine_p, '_other', cancel=cancel, stats=stats, **options)
+        if result['solution'].intervals is not None:
+            result['intervals'] = result['solution'].intervals
+        if result['solution'].estimated:
+            result['estimated'] = sorted(result['solution'].estimated)
     except mnsw.InconsistencyError:
         result['solution'] = None
+    except mnsw.CostExceeded, e:
+        result['solution'] = None
+        result['error'] = 'too costly'
+        result['cost'] = e.cost
+    end = time.time()
+    result['processing_time'] = end - start
+    # breakdown of processing_time by phase, and of the work done
+    result['stats'] = stats.as_dict()
+
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+def canonical_key(payload):
+    """digest of the board an api payload describes, and of the options that
+    affect its solution, that does not depend on the order of the rules or
+    of the cells within them"""
+    if 'board' in payload:
+        board = [ln.strip() for ln in payload['board'].strip().split()]
+        key = {'board': board, 'total_mines': payload['total_mines']}
+    else:
+        # a duplicate rule says nothing new
+        rules = sorted(set((r['num_mines'], tuple(sorted(r['cells']))) for r in payload['rules']))
+        key = {'rules': rules}
+        if 'mine_prob' in payload:
+            key['mine_prob'] = payload['mine_prob']
+        else:
+            key['total_cells'] = payload['total_cells']
+            key['total_mines'] = payload['total_mines']
+    # options that change the solution; the rest only affect whether or how
+    # quickly it is found
+    key.update((k, payload[k]) for k in ('mode', 'budget') if k in payload)
+    return hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()
+
+class ResultCache(object):
+    """a cache of api_solve() results, keyed by canonical_key(), of bounded
+    size (in total cells across the cached solutions) with least-recently-
+    used eviction. only complete results are kept: not errors, nor those
+    with estimates for fronts that ran out of time, nor those approximated
+    for being too costly. safe to share between threads
+
+    hits, misses -- # of lookups that found/didn't find a result
+    """
+
+    def __init__(self, max_cells=200000):
+        self.results = LRUCache(max_cells, lambda result: 1 + len(result['solution'] or ()))
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """return the cached result for key, marked 'cached', or None"""
+        with self.lock:
+            result = self.results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        result = dict(result)
+        result['cached'] = True
+        return result
+
+    def put(self, key, result):
+        if 'error' in result or 'estimated' in result or 'approximated' in result:
+            return
+        with self.lock:
+            self.results[key] = result
+
+    def counters(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.results), 'cells': self.results.size}
+
+def api_solve_batch(payload, cancel=None):
+    """solve many boards at once (see minesweeper.solve_many()); the payload
+    has a list of 'problems', each a payload as for api_solve(), and an
+    optional 'engine'. returns a 'solutions' list in the same order, None for
+    each board that is inconsistent. if any problem is invalid, none are
+    solved, and the result has an 'error' instead"""
+    try:
+        check_api_options(payload)
+        problems = [parse_api_payload(problem) for problem in payload['problems']]
+    except PayloadError, e:
+        return {'solutions': None, 'error': str(e)}
+    options = dict((k, payload[k]) for k in ('engine',) if k in payload)
+
+    result = {}
+    stats = mnsw.SolveStats()
+    start = time.time()
+    result['solutions'] = mnsw.solve_many(problems, '_other', cancel=cancel, stats=stats, **options)
     end = time.time()
     result['processing_time'] = end - start
+    result['stats'] = stats.as_dict()
 
     return result
 
@@ -1,6 +1,9 @@
 import math
 import operator
 import collections
+import fractions
+import itertools
+import threading
 
 def fact_div(a, b):
     """return a! / b!"""
@@ -14,7 +17,41 @@ def choose(n, k):
         # optimize by far most-common case
         return 1
 
-    return fact_div(n, max(k, n - k)) / math.factorial(min(k, n - k))
+    cacheable = 0 <= k <= n <= CHOOSE_CACHE_MAX_N
+    if cacheable:
+        try:
+            return _choose_cache[(n, k)]
+        except KeyError:
+            pass
+    c = fact_div(n, max(k, n - k)) / math.factorial(min(k, n - k))
+    if cacheable:
+        _choose_cache[(n, k)] = c
+    return c
+
+# only small n (the sizes of supercells, by far the most common) are cached,
+# so the cache is bounded -- to ~2000 entries -- without needing eviction
+CHOOSE_CACHE_MAX_N = 64
+_choose_cache = {}
+
+_log_factorials = [0.]
+def log_factorial(n):
+    """return ln(n!), from a table that is extended as needed"""
+    if n < 0:
+        raise ValueError('n must be >= 0')
+    table = _log_factorials
+    if len(table) <= n:
+        # solves may run in concurrent threads
+        with _log_factorials_lock:
+            while len(table) <= n:
+                table.append(math.lgamma(len(table) + 1))
+    return table[n]
+_log_factorials_lock = threading.Lock()
+
+def log_choose(n, k):
+    """return ln(n choose k)"""
+    if k < 0 or k > n:
+        raise ValueError('k must be [0, n]')
+    return log_factorial(n) - log_factorial(k) - log_factorial(n - k)
 
 def peek(iterable):
     """return an arbitrary item from a collection; no ordering is guaranteed
@@ -67,6 +104,8 @@ def map_reduce(data, emitfunc=lambda rec: [(rec,)], reducefunc=lambda v: v):
 class ImmutableMixin(object):
     """mixin for immutable, hashable objects"""
 
+    __slots__ = ()
+
     def _canonical(self):
         """return the 'core' data of this object in a hashable format, usually a tuple"""
         assert False, 'must override'
@@ -76,3 +115,168 @@ class ImmutableMixin(object):
         return not (self == o)
     def __hash__(self):
         return hash(self._canonical())
+
+class LRUCache(object):
+    """a mapping of bounded size that evicts the least-recently-used entry
+    once full. safe to share between threads"""
+
+    def __init__(self, maxsize, sizeof=None):
+        """
+        maxsize -- max # of entries to retain; or with 'sizeof', max total
+            size of the entries
+        sizeof -- optional function: value -> its size, in any units
+        """
+        self.maxsize = maxsize
+        self.sizeof = sizeof or (lambda value: 1)
+        self.data = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.data.pop(key)
+            # re-insert to mark as most recently used
+            self.data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self.data:
+                self.size -= self.sizeof(self.data.pop(key))
+            self.data[key] = value
+            self.size += self.sizeof(value)
+            while self.size > self.maxsize:
+                k, v = self.data.popitem(last=False)
+                self.size -= self.sizeof(v)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+NEG_INF = float('-inf')
+
+class LogNumber(object):
+    """a non-negative real number stored as its natural logarithm. supports
+    the arithmetic needed to sum and multiply weights of wildly different
+    magnitudes without overflowing or underflowing"""
+
+    __slots__ = ('log',)
+
+    def __init__(self, log):
+        self.log = log
+
+    @staticmethod
+    def of(x):
+        """convert a plain number (int, long, float) to a LogNumber"""
+        if x.__class__ is LogNumber:
+            return x
+        if x < 0:
+            raise ValueError('LogNumber must be non-negative')
+        # math.log handles arbitrarily large longs without converting to float
+        return LogNumber(math.log(x) if x > 0 else NEG_INF)
+
+    def __mul__(self, o):
+        if o.__class__ is not LogNumber:
+            o = LogNumber.of(o)
+        return LogNumber(self.log + o.log)
+    __rmul__ = __mul__
+
+    def __div__(self, o):
+        if o.__class__ is not LogNumber:
+            o = LogNumber.of(o)
+        if o.log == NEG_INF:
+            raise ZeroDivisionError('LogNumber division by zero')
+        return LogNumber(self.log - o.log)
+    __truediv__ = __div__
+
+    def __rdiv__(self, o):
+        return LogNumber.of(o) / self
+    __rtruediv__ = __rdiv__
+
+    def __pow__(self, e):
+        return LogNumber(self.log * e) if e else LogNumber(0.)
+
+    def __add__(self, o):
+        if o.__class__ is not LogNumber:
+            o = LogNumber.of(o)
+        a, b = self.log, o.log
+        if a < b:
+            a, b = b, a
+        if b == NEG_INF:
+            return LogNumber(a)
+        return LogNumber(a + math.log1p(math.exp(b - a)))
+    __radd__ = __add__
+
+    def __float__(self):
+        return math.exp(self.log)
+
+    def __cmp__(self, o):
+        return cmp(self.log, LogNumber.of(o).log)
+
+    def __hash__(self):
+        return hash(self.log)
+
+    def __repr__(self):
+        return 'LogNumber(%r)' % self.log
+
+class LogArithmetic(object):
+    """numeric backend that carries weights as LogNumbers; binomial ratios come
+    from cached log-factorial tables. fast and free of overflow on boards of
+    any size, at the cost of float precision"""
+
+    def number(self, x):
+        return LogNumber.of(x)
+
+    def binomial_ratio(self, n, k, k0):
+        """return 'n choose k' / 'n choose k0'"""
+        return LogNumber(log_choose(n, k) - log_choose(n, k0))
+
+    def power(self, x, e):
+        """return x^e"""
+        return LogNumber.of(x) ** e
+
+    def dot(self, xs, ys):
+        """return the sum of pairwise products of two sequences of numbers"""
+        logs = [x.log + y.log for x, y in itertools.izip(xs, ys)]
+        top = max(logs) if logs else NEG_INF
+        if top == NEG_INF:
+            return LogNumber(NEG_INF)
+        return LogNumber(top + math.log(sum(math.exp(l - top) for l in logs)))
+
+class ExactArithmetic(object):
+    """numeric backend that carries weights as exact integers and fractions.
+    slow on large boards; meant as a reference to verify other backends
+    against"""
+
+    def number(self, x):
+        return x if isinstance(x, (int, long)) else fractions.Fraction(x)
+
+    def binomial_ratio(self, n, k, k0):
+        """return 'n choose k' / 'n choose k0'"""
+        return fractions.Fraction(choose(n, k), choose(n, k0))
+
+    def power(self, x, e):
+        """return x^e"""
+        return fractions.Fraction(x) ** e
+
+    def dot(self, xs, ys):
+        """return the sum of pairwise products of two sequences of numbers"""
+        return sum(x * y for x, y in itertools.izip(xs, ys))
+
+NUMERIC_BACKENDS = {
+    'log': LogArithmetic(),
+    'exact': ExactArithmetic(),
+}
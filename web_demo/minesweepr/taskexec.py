@@ -4,6 +4,11 @@ import sys
 import json as ser
 import os
 import os.path
+import Queue
+import select
+import struct
+import time
+import traceback
 
 class ExecTimeOut(Exception):
     pass
@@ -19,6 +24,60 @@ def exec_capped(task, time_limit, *args, **kwargs):
     _task.join(time_limit)
     return _task.resolve()
 
+def exec_cooperative(task, time_limit, token, *args, **kwargs):
+    """execute a task in-process, in a separate thread, capping execution
+    time at 'time_limit' by asking the task to stop rather than by killing a
+    process. this avoids the cost of starting a fresh interpreter per task
+
+    the task must accept a 'cancel' keyword argument -- 'token' is passed
+    through -- and must return promptly once token.cancel() is called (e.g.,
+    a minesweeper.CancelToken passed on to solve())
+    """
+    _task = cooperative_executor(task, token, *args, **kwargs)
+    _task.start()
+    _task.join(time_limit)
+    return _task.resolve()
+
+def exec_pooled(pool, task, time_limit, *args, **kwargs):
+    """execute a task in one of the long-lived worker processes of 'pool' (a
+    WorkerPool), capping execution time at 'time_limit'. this avoids the cost
+    of starting (and importing into) a fresh interpreter per task, while
+    keeping the ability to kill a runaway task outright"""
+    return pool.run(task, time_limit, *args, **kwargs)
+
+class cooperative_executor(threading.Thread):
+    """run a cancellable task in a separate thread"""
+    # time to wait for a cancelled task to wind down
+    CANCEL_GRACE = 1. #s
+
+    def __init__(self, task, token, *args, **kwargs):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.task = task
+        self.token = token
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+
+    def run(self):
+        try:
+            self.result = (True, self.task(*self.args, cancel=self.token, **self.kwargs))
+        except Exception, e:
+            self.result = (False, e)
+
+    def resolve(self):
+        if self.isAlive():
+            self.token.cancel()
+            self.join(self.CANCEL_GRACE)
+            raise ExecTimeOut
+        else:
+            success, result = self.result
+            if success:
+                return result
+            else:
+                raise result
+
 class executor(threading.Thread):
     """wait for task result in a separate thread, so we can kill it
     if it times out."""
@@ -30,8 +89,7 @@ class executor(threading.Thread):
         self.kwargs = kwargs
 
     def start(self):
-        project_root = filter(lambda p: p, sys.path)[0] # sketchy
-        self.p = Popen(['python', os.path.join(os.getcwd(), __file__)], cwd=project_root, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        self.p = Popen(['python', os.path.join(os.getcwd(), __file__)], cwd=project_root(), stdin=PIPE, stdout=PIPE, stderr=PIPE)
 
         threading.Thread.start(self)
 
@@ -63,6 +121,159 @@ class executor(threading.Thread):
             else:
                 raise Exception('error in task> ' + result)
 
+class WorkerPool(object):
+    """a fixed-size pool of worker processes that are started up front and
+    then run task after task, each sent over the worker's stdin as a
+    length-prefixed message (with the result coming back likewise over its
+    stdout)
+
+    a worker whose task runs out of time is killed and replaced, as is one
+    that has run 'max_jobs' tasks (to cap the growth of its memory use). the
+    replacement is started in the background, so the task's caller need not
+    wait on it
+    """
+    # time to wait before trying again to start a worker that failed to
+    SPAWN_RETRY = 1. #s
+
+    def __init__(self, size, preload=[], max_jobs=None, codec=None):
+        """
+        size -- # of worker processes
+        preload -- modules for each worker to import at startup, rather than
+            on its first task
+        max_jobs -- optional # of tasks after which to replace a worker
+        codec -- optional name of a module with dumps() and loads() with
+            which to encode messages, in place of json (e.g., a more compact
+            binary format)
+        """
+        self.preload = list(preload)
+        self.max_jobs = max_jobs
+        self.codec = codec
+        self.idle = Queue.Queue()
+        for i in xrange(size):
+            self.idle.put(self.spawn())
+
+    def spawn(self):
+        return Worker(self.preload, self.codec)
+
+    def run(self, task, time_limit, *args, **kwargs):
+        """run a task in the next free worker; block until one is free"""
+        worker = self.idle.get()
+        try:
+            success, result = worker.run(task, time_limit, args, kwargs)
+        except Exception:
+            # timed out or died; either way, of no further use
+            self.replace(worker)
+            raise
+        if self.max_jobs is not None and worker.jobs >= self.max_jobs:
+            self.replace(worker)
+        else:
+            self.idle.put(worker)
+
+        if success:
+            return result
+        else:
+            raise Exception('error in task> ' + result)
+
+    def replace(self, worker):
+        """kill a worker, and in a background thread, start another in its
+        place"""
+        def respawn():
+            worker.terminate()
+            while True:
+                try:
+                    self.idle.put(self.spawn())
+                    return
+                except Exception:
+                    traceback.print_exc()
+                    time.sleep(self.SPAWN_RETRY)
+        thread = threading.Thread(target=respawn)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """shut down all workers; only call when no tasks are running"""
+        while True:
+            try:
+                self.idle.get_nowait().terminate()
+            except Queue.Empty:
+                break
+
+class Worker(object):
+    """a long-lived worker process; see WorkerPool"""
+
+    def __init__(self, preload, codec=None):
+        self.p = Popen(['python', os.path.join(os.getcwd(), __file__), '--worker', codec or ''] + preload,
+                       cwd=project_root(), stdin=PIPE, stdout=PIPE)
+        self.codec = load_codec(codec)
+        self.jobs = 0
+
+    def run(self, task, time_limit, args, kwargs):
+        """run a task; return (success, result or error message). raise
+        ExecTimeOut if the task runs past 'time_limit'"""
+        self.jobs += 1
+        payload = {'task': '%s.%s' % (task.__module__, task.__name__), 'args': args, 'kwargs': kwargs}
+        try:
+            write_message(self.p.stdin, self.codec.dumps(payload))
+        except IOError:
+            raise Exception('worker process exited')
+        response = self.codec.loads(self.read_message(time_limit))
+        if 'error' in response:
+            return (False, response['error'])
+        return (True, response['result'])
+
+    def read_message(self, time_limit):
+        fd = self.p.stdout.fileno()
+        deadline = time.time() + time_limit if time_limit is not None else None
+        buf = ''
+        size = None
+        while size is None or len(buf) < size:
+            timeout = max(deadline - time.time(), 0.) if deadline is not None else None
+            ready, _, _ = select.select([fd], [], [], timeout)
+            if not ready:
+                raise ExecTimeOut
+            chunk = os.read(fd, 1 << 20)
+            if not chunk:
+                raise Exception('worker process exited')
+            buf += chunk
+            if size is None and len(buf) >= MESSAGE_HEADER.size:
+                size, = MESSAGE_HEADER.unpack_from(buf)
+                buf = buf[MESSAGE_HEADER.size:]
+        # the worker only ever sends one message per task
+        return buf
+
+    def terminate(self):
+        try:
+            self.p.kill()
+        except OSError:
+            # already exited
+            pass
+        self.p.wait()
+
+# each message is prefixed with its length
+MESSAGE_HEADER = struct.Struct('>I')
+
+def write_message(f, data):
+    f.write(MESSAGE_HEADER.pack(len(data)))
+    f.write(data)
+    f.flush()
+
+def read_message(f):
+    """read a message from a blocking file; None at end of file"""
+    header = f.read(MESSAGE_HEADER.size)
+    if len(header) < MESSAGE_HEADER.size:
+        return None
+    size, = MESSAGE_HEADER.unpack(header)
+    return f.read(size)
+
+def load_codec(codec):
+    """the module to encode messages with, by name; json if none"""
+    if not codec:
+        return ser
+    return __import__(codec, fromlist=['loads'])
+
+def project_root():
+    return filter(lambda p: p, sys.path)[0] # sketchy
+
 def _exec(payload):
     taskname = payload['task']
     module = '.'.join(taskname.split('.')[:-1])
@@ -72,6 +283,32 @@ def _exec(payload):
     return func(*payload['args'], **payload['kwargs'])
     #exception will dump to stderr
 
+def serve(codec, preload):
+    """worker process main loop; see WorkerPool"""
+    codec = load_codec(codec)
+    for module in preload:
+        __import__(module)
+    # anything the tasks print must not get mixed in with the results
+    out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    sys.stdout = sys.stderr
+
+    while True:
+        message = read_message(sys.stdin)
+        if message is None:
+            return
+        try:
+            response = {'result': _exec(codec.loads(message))}
+        except Exception:
+            response = {'error': traceback.format_exc()}
+        try:
+            data = codec.dumps(response)
+        except Exception:
+            data = codec.dumps({'error': traceback.format_exc()})
+        write_message(out, data)
+
 if __name__ == "__main__":
     sys.path.insert(0, os.getcwd()) # cwd set to django project root dir
-    print ser.dumps(_exec(ser.load(sys.stdin)))
+    if sys.argv[1:2] == ['--worker']:
+        serve(sys.argv[2], sys.argv[3:])
+    else:
+        print ser.dumps(_exec(ser.load(sys.stdin)))
@@ -3,6 +3,7 @@ from django.conf import settings
 
 dynurls = patterns('minesweepr.views',
     (r'^api/minesweeper_solve/$', 'api_solve'),
+    (r'^api/minesweeper_solve_batch/$', 'api_solve_batch'),
 )
 
 staticurls = patterns('minesweepr.views',
@@ -5,10 +5,16 @@ from django.shortcuts import render_to_response
 from django.conf import settings
 import json
 import logging
+import os
+import threading
 import time
-from taskexec import exec_capped, ExecTimeOut
+from taskexec import exec_capped, exec_cooperative, exec_pooled, WorkerPool, ExecTimeOut
 import itertools
 
+if settings.FRONT_STORE:
+    # opened by the solver in whichever process it runs (see minesweeper.py)
+    os.environ['MINESWEEPR_FRONT_STORE'] = settings.FRONT_STORE
+
 @csrf_exempt
 def api_solve(request):
     if settings.DEBUG_DELAY:
@@ -18,16 +24,102 @@ def api_solve(request):
     logging.debug('>>' + str(payload))
 
     start = time.time()
+    from lib.minesweeper_util import check_api_options, PayloadError
     try:
-        from lib.minesweeper_util import api_solve
-        result = exec_capped(api_solve, settings.CPU_QUOTA, payload)
-    except ExecTimeOut:
-        result = {'error': 'cpu quota exceeded'}
+        check_api_options(payload)
+    except PayloadError, e:
+        # before the cache, which would answer regardless
+        return HttpResponse(json.dumps({'solution': None, 'error': str(e)}), 'text/json')
+
+    cache = result_cache()
+    if cache is not None:
+        from lib.minesweeper_util import canonical_key
+        # before the payload is amended below
+        key = canonical_key(payload)
+        result = cache.get(key)
+        if result is not None:
+            log_result(payload, result, time.time() - start)
+            return HttpResponse(json.dumps(result), 'text/json')
+
+    if settings.CPU_QUOTA is not None:
+        # return a partial solution rather than running out the clock
+        payload['deadline'] = min(payload.get('deadline', settings.SOLVE_DEADLINE), settings.SOLVE_DEADLINE)
+
+    if settings.MAX_EXACT_COST is not None and 'max_cost' not in payload:
+        # boards too big to solve exactly within quota are solved approximately
+        payload['max_cost'] = settings.MAX_EXACT_COST
+
+    result = run_solve(payload)
+    if result.get('approximated'):
+        logging.info('estimated cost %g too high; solved approximately' % result['cost'])
+    if cache is not None:
+        cache.put(key, result)
     log_result(payload, result, time.time() - start)
 
     logging.debug('<<' + str(result))
     return HttpResponse(json.dumps(result), 'text/json')
 
+@csrf_exempt
+def api_solve_batch(request):
+    payload = json.loads(request.raw_post_data)
+    logging.debug('>>' + str(payload))
+
+    start = time.time()
+    from lib.minesweeper_util import api_solve_batch
+    result = run_task(api_solve_batch, settings.BATCH_CPU_QUOTA, payload)
+    try:
+        solved_in = '%.3f' % result['processing_time']
+    except KeyError:
+        solved_in = '--'
+    logging.info('batch of %d boards; solved in %s, task queue rtt %.3f' %
+                 (len(payload['problems']), solved_in, time.time() - start))
+
+    logging.debug('<<' + str(result))
+    return HttpResponse(json.dumps(result), 'text/json')
+
+def run_solve(payload):
+    from lib.minesweeper_util import api_solve
+    return run_task(api_solve, settings.CPU_QUOTA, payload)
+
+def run_task(task, time_limit, payload):
+    try:
+        from lib.minesweeper_util import mnsw
+        if time_limit is None:
+            return exec_capped(task, time_limit, payload)
+        elif settings.SOLVE_IN_PROCESS:
+            return exec_cooperative(task, time_limit, mnsw.CancelToken(), payload)
+        elif settings.SOLVER_POOL_SIZE:
+            return exec_pooled(solver_pool(), task, time_limit, payload)
+        else:
+            return exec_capped(task, time_limit, payload)
+    except ExecTimeOut:
+        return {'error': 'cpu quota exceeded'}
+
+_solver_pool = None
+_solver_pool_lock = threading.Lock()
+def solver_pool():
+    """the shared pool of solver processes, started on first use"""
+    global _solver_pool
+    with _solver_pool_lock:
+        if _solver_pool is None:
+            codec = {'binary': 'lib.wire', 'json': None}[settings.SOLVER_WIRE_FORMAT]
+            _solver_pool = WorkerPool(settings.SOLVER_POOL_SIZE, ['lib.minesweeper_util'], settings.SOLVER_MAX_JOBS, codec)
+        return _solver_pool
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+def result_cache():
+    """the shared cache of solutions to recently posted boards, or None if
+    disabled"""
+    global _result_cache
+    if not settings.RESULT_CACHE_CELLS:
+        return None
+    with _result_cache_lock:
+        if _result_cache is None:
+            from lib.minesweeper_util import ResultCache
+            _result_cache = ResultCache(settings.RESULT_CACHE_CELLS)
+        return _result_cache
+
 def log_result(payload, result, rtt):
     if 'rules' in payload:
         num_rules = len(payload['rules'])
@@ -42,9 +134,19 @@ def log_result(payload, result, rtt):
         solved_in = '%.3f' % result['processing_time']
     except KeyError:
         solved_in = '--'
+    try:
+        timings = result['stats']['timings']
+        slowest = max(timings, key=timings.get)
+        slowest_phase = '%s %.3f' % (slowest, timings[slowest])
+    except KeyError:
+        slowest_phase = '--'
+
+    if result.get('cached'):
+        counters = result_cache().counters()
+        solved_in += ' (cached; %d hits, %d misses)' % (counters['hits'], counters['misses'])
 
-    logging.info('%d rules %d cells %.1f avg cpr; solved in %s, task queue rtt %.3f' %
-                 (num_rules, num_uniq_cells, avg_cells_per_rule, solved_in, rtt))
+    logging.info('%d rules %d cells %.1f avg cpr; solved in %s (slowest phase %s), task queue rtt %.3f' %
+                 (num_rules, num_uniq_cells, avg_cells_per_rule, solved_in, slowest_phase, rtt))
 
 def template_static(request, **kwargs):
     url = request.path[1:-1]
@@ -111,6 +111,36 @@ STATIC_ROOT = None
 
 # set to 'None' to bypass process pool for debugging
 CPU_QUOTA = 5. #s
+# time after which the solver stops tallying and returns a partial solution,
+# with estimates for whatever is left; must leave headroom under CPU_QUOTA
+# for process startup and the estimates themselves
+SOLVE_DEADLINE = 3.5 #s
+# solve in a thread of the server process, stopping it cooperatively at
+# CPU_QUOTA, rather than in a subprocess (which must be killed outright, but
+# isolates the server from runaway memory use)
+SOLVE_IN_PROCESS = False
+# # of long-lived solver processes to hand requests to; a process that runs
+# past CPU_QUOTA is killed and replaced. 0 to start a fresh process per
+# request instead
+SOLVER_POOL_SIZE = 4
+# replace a solver process after this many requests, to bound its memory
+# use; 'None' for never
+SOLVER_MAX_JOBS = 500
+# encoding of requests and results passed to and from solver processes:
+# 'binary' (compact; see wire.py) or 'json'
+SOLVER_WIRE_FORMAT = 'binary'
+# max size of the cache of solutions to recently posted boards, in total
+# cells across all cached solutions; 0 to disable
+RESULT_CACHE_CELLS = 200000
+# optional path of a database in which solver processes share the tallies of
+# the fronts they enumerate, which also survives restarts (see
+# minesweeper.FrontStore)
+FRONT_STORE = None
+# boards whose estimated cost to solve exactly (see minesweeper.front_cost())
+# exceeds this are solved approximately instead; 'None' to always try exactly
+MAX_EXACT_COST = 1e6
+# cpu quota for a batch of boards (api_solve_batch); 'None' for no limit
+BATCH_CPU_QUOTA = 60. #s
 
 # add a delay when running locally to simulate server latency
 DEBUG_DELAY = 0. #s
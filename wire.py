@@ -0,0 +1,121 @@
+"""compact binary encoding of solver api payloads and results, for passing
+them between processes (see web_demo's taskexec); a drop-in for the json
+module there, via dumps() and loads()
+
+the message is kept as json, except that the bulky parts are packed into
+binary blobs appended after it:
+  rules (a 'rules' list of {'num_mines', 'cells'}) -- cell names are listed
+      once, and each rule becomes its # of mines, # of cells, and the
+      indexes of its cells, as an array of ints
+  solutions (a 'solution' mapping: cell -> probability, or a 'solutions'
+      list of them) -- cells are listed by name, apart from those that are
+      certain, and their probabilities become an array of doubles (so they
+      decode exactly)
+
+arrays are in native byte order, as both ends are on the same machine
+
+anything else, and anything not of quite the expected form, passes through
+as json. loads() also accepts plain json, so either side may fall back to it
+
+packed parts are marked by a '_packed' key; a dict of the caller's own that
+has such a key is escaped, so it can't be mistaken for one
+"""
+import array
+import json
+import struct
+
+MAGIC = 'MSW1'
+
+def dumps(obj):
+    blobs = []
+    header = json.dumps(_pack(obj, blobs), separators=(',', ':'))
+    parts = [MAGIC, struct.pack('<I', len(header)), header]
+    for blob in blobs:
+        parts.extend([struct.pack('<I', len(blob)), blob])
+    return ''.join(parts)
+
+def loads(data):
+    if not data.startswith(MAGIC):
+        return json.loads(data)
+
+    pos = len(MAGIC)
+    chunks = []
+    while pos < len(data):
+        size, = struct.unpack_from('<I', data, pos)
+        chunks.append(buffer(data, pos + 4, size))
+        pos += 4 + size
+    return _unpack(json.loads(str(chunks[0])), chunks[1:])
+
+def _pack(obj, blobs, key=None):
+    """replace the packable parts of 'obj' with references into 'blobs'"""
+    if key == 'rules' and is_rule_list(obj):
+        index = {}
+        names = []
+        ints = array.array('i')
+        for rule in obj:
+            ints.extend((rule['num_mines'], len(rule['cells'])))
+            for cell in rule['cells']:
+                if cell not in index:
+                    index[cell] = len(names)
+                    names.append(cell)
+                ints.append(index[cell])
+        return {'_packed': 'rules', 'cells': names, 'blob': _add_blob(blobs, ints)}
+    elif key == 'solution' and is_solution(obj):
+        # cells known to be safe or mines (typically most of them) need no
+        # probability stored
+        safe = [name for name, p in obj.iteritems() if p == 0.]
+        mines = [name for name, p in obj.iteritems() if p == 1.]
+        names = [name for name, p in obj.iteritems() if p not in (0., 1.)]
+        probs = array.array('d', (obj[name] for name in names))
+        return {'_packed': 'solution', 'safe': safe, 'mines': mines, 'cells': names, 'blob': _add_blob(blobs, probs)}
+    elif isinstance(obj, dict):
+        packed = dict((k, _pack(v, blobs, k)) for k, v in obj.iteritems())
+        if '_packed' in obj:
+            return {'_packed': 'dict', 'items': packed}
+        return packed
+    elif isinstance(obj, (list, tuple)):
+        return [_pack(v, blobs, 'solution' if key == 'solutions' else None) for v in obj]
+    else:
+        return obj
+
+def _unpack(obj, blobs):
+    """inverse of _pack()"""
+    if isinstance(obj, dict):
+        kind = obj.get('_packed')
+        if kind == 'rules':
+            ints = array.array('i')
+            ints.fromstring(blobs[obj['blob']])
+            names = obj['cells']
+            rules = []
+            i = 0
+            while i < len(ints):
+                num_mines, num_cells = ints[i:i + 2]
+                rules.append({'num_mines': num_mines, 'cells': [names[c] for c in ints[i + 2:i + 2 + num_cells]]})
+                i += 2 + num_cells
+            return rules
+        elif kind == 'solution':
+            probs = array.array('d')
+            probs.fromstring(blobs[obj['blob']])
+            solution = dict(zip(obj['cells'], probs))
+            solution.update((name, 0.) for name in obj['safe'])
+            solution.update((name, 1.) for name in obj['mines'])
+            return solution
+        elif kind == 'dict':
+            return dict((k, _unpack(v, blobs)) for k, v in obj['items'].iteritems())
+        return dict((k, _unpack(v, blobs)) for k, v in obj.iteritems())
+    elif isinstance(obj, list):
+        return [_unpack(v, blobs) for v in obj]
+    else:
+        return obj
+
+def _add_blob(blobs, arr):
+    blobs.append(arr.tostring())
+    return len(blobs) - 1
+
+def is_rule_list(obj):
+    return isinstance(obj, list) and all(isinstance(rule, dict) and set(rule) == set(['num_mines', 'cells']) and
+                                         type(rule['num_mines']) is int and isinstance(rule['cells'], list)
+                                         for rule in obj)
+
+def is_solution(obj):
+    return isinstance(obj, dict) and all(type(p) is float for p in obj.itervalues())